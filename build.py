@@ -1,5 +1,8 @@
 import distutils.command.build_py
 import distutils.command.sdist
+import gzip
+import hashlib
+import json
 import os
 import sys
 from abc import ABC
@@ -7,9 +10,15 @@ from subprocess import check_call
 
 from setuptools import Command
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 this_directory = os.path.abspath(os.path.dirname(__file__))
 jupyterhub_directory = os.path.join(this_directory, "share", "jupyterhub")
 static_directory = os.path.join(jupyterhub_directory, "static", "dossier")
+static_manifest = os.path.join(static_directory, "manifest.json")
 
 
 def get_data_files():
@@ -130,10 +139,66 @@ class npm(BaseCommand):
         assert not self.should_run(), "NPM.run failed"
 
 
+class static(BaseCommand):
+    """Emit fingerprinted and precompressed variants of the static assets."""
+
+    def _compress(self, path, data):
+        # Variants of previous builds may be stale, or may no longer pay off
+        for suffix in (".gz", ".br"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        variants = [(".gz", gzip.compress(data, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variants.append((".br", brotli.compress(data)))
+        for suffix, compressed in variants:
+            # Skip variants that do not pay off, e.g., for already compressed images
+            if len(compressed) < 0.9 * len(data):
+                with open(path + suffix, "wb") as f:
+                    f.write(compressed)
+
+    def run(self):
+        if brotli is None:
+            print(
+                "Brotli is not installed, skipping .br static assets", file=sys.stderr
+            )
+        # Remove the outputs of previous builds
+        if os.path.exists(static_manifest):
+            with open(static_manifest) as f:
+                for fingerprinted in json.load(f).values():
+                    for suffix in ("", ".gz", ".br"):
+                        path = os.path.join(static_directory, fingerprinted + suffix)
+                        if os.path.exists(path):
+                            os.remove(path)
+        print("Fingerprinting and compressing static assets")
+        manifest = {}
+        for dirpath, dirnames, filenames in os.walk(static_directory):
+            for f in filenames:
+                if f.endswith((".gz", ".br", ".less")) or f == "manifest.json":
+                    continue
+                path = os.path.join(dirpath, f)
+                with open(path, "rb") as fd:
+                    data = fd.read()
+                root, ext = os.path.splitext(f)
+                digest = hashlib.sha256(data).hexdigest()[:16]
+                fingerprinted = os.path.join(dirpath, f"{root}.{digest}{ext}")
+                with open(fingerprinted, "wb") as fd:
+                    fd.write(data)
+                self._compress(path, data)
+                self._compress(fingerprinted, data)
+                manifest[os.path.relpath(path, static_directory)] = os.path.relpath(
+                    fingerprinted, static_directory
+                )
+        with open(static_manifest, "w") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        # update data-files in case this created new files
+        self.distribution.data_files = get_data_files()
+
+
 class build_py(distutils.command.build_py.build_py):
     def run(self) -> None:
         self.run_command("js")
         self.run_command("css")
+        self.run_command("static")
         return super().run()
 
 
@@ -141,4 +206,5 @@ class sdist(distutils.command.sdist.sdist):
     def run(self) -> None:
         self.run_command("js")
         self.run_command("css")
-        return super().run()
\ No newline at end of file
+        self.run_command("static")
+        return super().run()
@@ -1,14 +1,26 @@
 import logging
 import os
+import sys
+import time
+from functools import partial
 
 from jupyterhub.app import JupyterHub
-from tornado.web import StaticFileHandler
-from traitlets.traitlets import Unicode, default
+from jupyterhub.app import flags as hub_flags
+from jupyterhub.utils import url_path_join
+from traitlets.traitlets import Bool, Dict, Float, Integer, Unicode, default, observe
 
 from dossier import handlers
+from dossier.handlers.static import DossierStaticFileHandler
+from dossier.timing import ImportTimer
 
+flags = dict(hub_flags)
+flags["import-timing"] = (
+    {"Dossier": {"import_timing": True}},
+    "Log how long the imports performed during startup took.",
+)
 
-class DossierFaviconHandler(StaticFileHandler):
+
+class DossierFaviconHandler(DossierStaticFileHandler):
     """A singular handler for serving the logo."""
 
     def get(self):
@@ -21,11 +33,59 @@ class DossierFaviconHandler(StaticFileHandler):
 
 
 class Dossier(JupyterHub):
+    flags = Dict(flags)
+    import_timer = None
+
     favicon_file = Unicode(
         "",
         help="Specify path to a favicon image to override the Jupyter favicon in the browser tab.",
     ).tag(config=True)
 
+    k8s_api_connection_pool_maxsize = Integer(
+        100,
+        config=True,
+        help="Maximum number of concurrent connections to the Kubernetes API server.",
+    )
+
+    k8s_api_keepalive_timeout = Float(
+        15,
+        config=True,
+        help="Seconds to keep idle connections to the Kubernetes API server alive.",
+    )
+
+    k8s_api_request_timeout = Float(
+        30,
+        config=True,
+        help="Default timeout in seconds for requests to the Kubernetes API server.",
+    )
+
+    import_timing = Bool(
+        False,
+        config=True,
+        help="""
+        Log a report of the modules imported during startup, and how long they took.
+
+        Heavy dependencies, e.g., the Kubernetes client, KubeSpawner and AsyncSSH,
+        are imported on first use, so the report shows where startup time goes.
+        When enabled in a configuration file rather than with the
+        `--import-timing` flag, the imports performed before the file is loaded
+        are not reported.
+        """,
+    )
+
+    @observe("import_timing")
+    def _import_timing_changed(self, change):
+        if change.new and self.import_timer is None:
+            self.import_timer = ImportTimer()
+            self.import_timer.install()
+        elif not change.new and self.import_timer is not None:
+            self.import_timer.uninstall()
+            self.import_timer = None
+
+    @property
+    def dossier_static_path(self):
+        return os.path.join(self.data_files_path, "static", "dossier")
+
     @default("favicon_file")
     def _favicon_file_default(self):
         return os.path.join(self.data_files_path, "static", "dossier", "favicon.ico")
@@ -36,6 +96,49 @@ class Dossier(JupyterHub):
             self.data_files_path, "static", "dossier", "images", "dossier.png"
         )
 
+    async def initialize(self, *args, **kwargs):
+        start = time.perf_counter()
+        await super().initialize(*args, **kwargs)
+        if self.generate_config or self.generate_certs or self.subapp:
+            if self.import_timer is not None:
+                self.import_timer.uninstall()
+            return
+        await self.init_kubernetes_clients()
+        await self.init_reflectors()
+        if self.import_timer is not None:
+            self.import_timer.uninstall()
+            self.log.info(
+                f"Dossier initialized in {time.perf_counter() - start:.3f} seconds"
+            )
+            for line in self.import_timer.report():
+                self.log.info(line)
+
+    async def init_kubernetes_clients(self):
+        from dossier import clients
+
+        self.custom_api = await clients.create_custom_objects_api(
+            connection_pool_maxsize=self.k8s_api_connection_pool_maxsize,
+            keepalive_timeout=self.k8s_api_keepalive_timeout,
+            request_timeout=self.k8s_api_request_timeout,
+        )
+
+    async def init_reflectors(self):
+        from dossier import utils
+
+        utils.init_cache(parent=self)
+        await utils.start_reflectors(self.custom_api, parent=self)
+
+    async def cleanup(self):
+        from dossier import clients, utils
+
+        await utils.stop_reflectors()
+        await utils.close_cache()
+        await clients.close()
+        await super().cleanup()
+        # Spawners may have been stopped by the hub cleanup
+        if (ssh := sys.modules.get("dossier.spawners.ssh")) is not None:
+            await ssh.SSHSpawner.close_shared()
+
     def init_handlers(self):
         super().init_handlers()
         dossier_handlers = {
@@ -43,7 +146,16 @@ class Dossier(JupyterHub):
             for h in self.add_url_prefix(
                 self.hub_prefix,
                 handlers.default_handlers
-                + [(r"/favicon", DossierFaviconHandler, {"path": self.favicon_file})],
+                + [
+                    (r"/favicon", DossierFaviconHandler, {"path": self.favicon_file}),
+                    # Tornado routes everything under `static_url_prefix` to the
+                    # JupyterHub static handler first, so assets need their own
+                    (
+                        r"/dossier-static/(.*)",
+                        DossierStaticFileHandler,
+                        {"path": self.dossier_static_path},
+                    ),
+                ],
             )
         }
         for i, handler_tuple in enumerate(self.handlers):
@@ -64,6 +176,15 @@ class Dossier(JupyterHub):
         if dossier_template_paths not in self.template_paths:
             self.template_paths.append(dossier_template_paths)
         super().init_tornado_settings()
+        self.tornado_settings["jinja2_env"].globals["dossier_static_url"] = partial(
+            DossierStaticFileHandler.make_static_url,
+            {
+                "static_path": self.dossier_static_path,
+                "static_url_prefix": url_path_join(
+                    self.hub.base_url, "dossier-static/"
+                ),
+            },
+        )
 
 
 main = Dossier.launch_instance
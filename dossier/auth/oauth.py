@@ -1,17 +1,15 @@
 import logging
 
 from kubernetes_asyncio.client import CustomObjectsApi
-from kubespawner.clients import load_config, shared_client
 from oauthenticator.generic import GenericOAuthenticator
 
-from dossier import utils
+from dossier import clients, utils
 
 
 class DossierOAuthenticator(GenericOAuthenticator):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        load_config()
-        self.api: CustomObjectsApi = shared_client("CustomObjectsApi")
+    @property
+    def api(self) -> CustomObjectsApi:
+        return clients.custom_objects_api()
 
     async def check_allowed(self, username, authentication=None):
         if await super().check_allowed(username, authentication):
@@ -22,15 +20,19 @@ class DossierOAuthenticator(GenericOAuthenticator):
                     f"User {username} belongs to the following groups: {authentication['groups']}."
                 )
             # Users that belong to an existing tenant are allowed
-            tenants = {t["metadata"]["name"] for t in await utils.get_tenants(self.api)}
+            tenants = await utils.get_user_tenants(
+                self.api, authentication["groups"], metadata_only=True
+            )
             if self.log.isEnabledFor(logging.DEBUG):
                 if tenants:
                     self.log.debug(
-                        f"The following tenants have been found on the cluster: {','.join(tenants)}."
+                        f"User {username} can use the following tenants: {','.join(tenants)}."
                     )
                 else:
-                    self.log.debug("No tenants found on the cluster.")
-            return any(set(authentication["groups"]) & tenants)
+                    self.log.debug(
+                        f"No tenants found on the cluster for user {username}."
+                    )
+            return len(tenants) > 0
         else:
             if self.log.isEnabledFor(logging.WARNING):
                 self.log.warning(
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+import aiohttp
+from kubernetes_asyncio.client import ApiException
+from tornado import web
+from traitlets import Float, Integer
+from traitlets.config import LoggingConfigurable
+
+from dossier.metrics import (
+    KUBERNETES_CIRCUIT_OPEN,
+    KUBERNETES_REQUEST_FAILURES,
+    KUBERNETES_STALE_RESPONSES,
+)
+
+
+class KubernetesUnavailableError(web.HTTPError):
+    """Raised when the Kubernetes API server cannot serve a read and no usable
+    cached data is available. Handlers answer with 503 Service Unavailable."""
+
+    def __init__(self, log_message=None, *args, **kwargs):
+        super().__init__(
+            503,
+            log_message or "Kubernetes API server unavailable",
+            *args,
+            reason="Service Unavailable",
+            **kwargs,
+        )
+
+
+def _is_transient(error):
+    if isinstance(error, ApiException):
+        return error.status == 429 or (error.status or 0) >= 500
+    return isinstance(error, (asyncio.TimeoutError, aiohttp.ClientError, OSError))
+
+
+class ObjectCache(LoggingConfigurable):
+    """Serves Kubernetes API reads with stale-while-revalidate semantics.
+
+    Results younger than `max_age` are served directly. Older results are served
+    while a background refresh is in progress, as long as they are not older than
+    `max_staleness`. After `failure_threshold` consecutive failures, the circuit
+    opens and no request reaches the API server for `reset_timeout` seconds:
+    cached data is served when available, and `KubernetesUnavailableError` is
+    raised otherwise.
+    """
+
+    max_age = Float(
+        5,
+        config=True,
+        help="""
+        Seconds during which a cached result is served without refreshing it.
+        """,
+    )
+
+    max_staleness = Float(
+        300,
+        config=True,
+        help="""
+        Maximum age in seconds of a cached result served while it is refreshed in
+        the background, or while the Kubernetes API server is unavailable.
+        """,
+    )
+
+    max_entries = Integer(
+        1024,
+        config=True,
+        help="""
+        Maximum number of cached results. The least recently stored ones are
+        evicted first.
+        """,
+    )
+
+    failure_threshold = Integer(
+        5,
+        config=True,
+        help="""
+        Number of consecutive failed requests that opens the circuit.
+        """,
+    )
+
+    reset_timeout = Float(
+        30,
+        config=True,
+        help="""
+        Seconds to wait after the circuit opens before sending a trial request
+        to the Kubernetes API server.
+        """,
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.entries = {}
+        self.failures = 0
+        self.opened_at = None
+        self.refreshing = {}
+
+    @property
+    def degraded(self):
+        return self.opened_at is not None
+
+    def _allow_request(self):
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            # Half-open: let this request through and keep the others out
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+    def _on_success(self):
+        if self.opened_at is not None:
+            self.log.info("Kubernetes API server recovered, closing the circuit")
+            KUBERNETES_CIRCUIT_OPEN.set(0)
+        self.failures = 0
+        self.opened_at = None
+
+    def _on_failure(self, key, error):
+        KUBERNETES_REQUEST_FAILURES.labels(plural=key[1], verb=key[0]).inc()
+        self.failures += 1
+        if self.opened_at is None and self.failures >= self.failure_threshold:
+            self.log.warning(
+                f"Kubernetes API server failed {self.failures} consecutive requests "
+                f"(last error: {error!r}). Opening the circuit and serving cached "
+                f"data up to {self.max_staleness}s old"
+            )
+            KUBERNETES_CIRCUIT_OPEN.set(1)
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    async def _fetch(self, key, fetch):
+        if not self._allow_request():
+            raise KubernetesUnavailableError(
+                "Kubernetes API server unavailable, circuit is open"
+            )
+        try:
+            value = await fetch()
+        except Exception as e:
+            if not _is_transient(e):
+                raise
+            self._on_failure(key, e)
+            raise KubernetesUnavailableError(
+                f"Kubernetes API server unavailable: {e!r}"
+            ) from e
+        self._on_success()
+        self.entries.pop(key, None)
+        self.entries[key] = (time.monotonic(), value)
+        while len(self.entries) > self.max_entries:
+            del self.entries[next(iter(self.entries))]
+        return value
+
+    def _refreshed(self, key, task):
+        self.refreshing.pop(key, None)
+        if not task.cancelled() and (error := task.exception()) is not None:
+            self.log.warning(f"Cannot refresh cached {key[0]} of {key[1]}: {error}")
+
+    def _revalidate(self, key, fetch):
+        if self.degraded and time.monotonic() - self.opened_at < self.reset_timeout:
+            return
+        if key not in self.refreshing:
+            task = self.refreshing[key] = asyncio.ensure_future(self._fetch(key, fetch))
+            task.add_done_callback(lambda t: self._refreshed(key, t))
+
+    async def get(self, key, fetch):
+        """Return the result of `fetch()`, using the cached result stored under
+        `key` when possible. Keys are `(verb, plural, ...)` tuples."""
+        if (entry := self.entries.get(key)) is not None:
+            age = time.monotonic() - entry[0]
+            if age <= self.max_age:
+                return entry[1]
+            elif age <= self.max_staleness:
+                KUBERNETES_STALE_RESPONSES.labels(plural=key[1], verb=key[0]).inc()
+                self._revalidate(key, fetch)
+                return entry[1]
+        return await self._fetch(key, fetch)
+
+    async def close(self):
+        for task in list(self.refreshing.values()):
+            task.cancel()
+        self.refreshing.clear()
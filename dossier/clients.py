@@ -0,0 +1,76 @@
+"""Process-wide Kubernetes API clients shared by all Dossier components.
+
+The Dossier application configures the clients once at startup, so that request
+handlers, authenticators and spawners never parse the kubeconfig or create a new
+client on the request path. KubeSpawner is only imported when a client is
+requested outside a Dossier hub.
+"""
+
+from __future__ import annotations
+
+from kubernetes_asyncio import config
+from kubernetes_asyncio.client import ApiClient, Configuration, CustomObjectsApi, rest
+
+_custom_objects_api: CustomObjectsApi | None = None
+
+
+class _RESTClientObject(rest.RESTClientObject):
+    def __init__(self, configuration, keepalive_timeout, request_timeout):
+        super().__init__(configuration)
+        # aiohttp only accepts the keep-alive timeout in the connector constructor,
+        # so the connector created upstream is updated in place
+        self.pool_manager.connector._keepalive_timeout = keepalive_timeout
+        self.request_timeout = request_timeout
+
+    async def request(self, *args, _request_timeout=None, **kwargs):
+        return await super().request(
+            *args, _request_timeout=_request_timeout or self.request_timeout, **kwargs
+        )
+
+
+async def _load_config():
+    try:
+        config.load_incluster_config()
+    except config.ConfigException:
+        await config.load_kube_config()
+
+
+async def create_custom_objects_api(
+    connection_pool_maxsize, keepalive_timeout, request_timeout
+):
+    """Create the process-wide `CustomObjectsApi` client.
+
+    The client keeps up to `connection_pool_maxsize` connections to the API
+    server, keeps idle connections alive for `keepalive_timeout` seconds, and
+    applies `request_timeout` to all calls that do not set their own timeout."""
+    global _custom_objects_api
+    await _load_config()
+    configuration = Configuration.get_default_copy()
+    configuration.connection_pool_maxsize = connection_pool_maxsize
+    api_client = ApiClient(configuration)
+    await api_client.rest_client.close()
+    api_client.rest_client = _RESTClientObject(
+        configuration, keepalive_timeout, request_timeout
+    )
+    _custom_objects_api = CustomObjectsApi(api_client)
+    return _custom_objects_api
+
+
+def custom_objects_api():
+    """Return the process-wide `CustomObjectsApi` client.
+
+    Outside a Dossier hub, e.g., when Dossier components are plugged into a plain
+    JupyterHub, fall back to the KubeSpawner shared client."""
+    if _custom_objects_api is not None:
+        return _custom_objects_api
+    from kubespawner.clients import load_config, shared_client
+
+    load_config()
+    return shared_client("CustomObjectsApi")
+
+
+async def close():
+    global _custom_objects_api
+    if _custom_objects_api is not None:
+        await _custom_objects_api.api_client.close()
+        _custom_objects_api = None
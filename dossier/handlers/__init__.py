@@ -1,5 +1,12 @@
-from . import pages, login
+def __getattr__(name):
+    # Handlers depend on the Kubernetes client and KubeSpawner, which are
+    # imported on first use rather than when the `dossier` command starts
+    if name == "default_handlers":
+        from . import login, pages
 
-default_handlers = []
-for mod in (pages, login):
-    default_handlers.extend(mod.default_handlers)
+        default_handlers = []
+        for mod in (pages, login):
+            default_handlers.extend(mod.default_handlers)
+        globals()["default_handlers"] = default_handlers
+        return default_handlers
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
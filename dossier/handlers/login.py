@@ -1,14 +1,14 @@
 from jupyterhub.handlers import LogoutHandler
 from jupyterhub.utils import maybe_future
 
-from dossier.spawners.kubernetes import DossierKubeSpawner
+from dossier.spawners import is_kube_spawner
 
 
 class DossierLogoutHandler(LogoutHandler):
     async def handle_logout(self):
         if user := self.current_user:
             for spawner in user.spawners.values():
-                if isinstance(spawner, DossierKubeSpawner):
+                if is_kube_spawner(spawner):
                     if self.shutdown_on_logout or not (
                         spawner.ready or spawner.active or spawner.pending
                     ):
@@ -1,19 +1,66 @@
-import importlib
+import asyncio
+import hashlib
+import json
 import logging
-from typing import Any
+import os
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any
 
 from jupyterhub.handlers import BaseHandler
 from jupyterhub.handlers.pages import SpawnHandler
 from jupyterhub.utils import maybe_future, url_path_join
-from kubernetes_asyncio.client import CustomObjectsApi
-from kubespawner.clients import load_config, shared_client
 from slugify import slugify
 from tornado import httputil, web
 from tornado.httputil import url_concat
 from tornado.web import Application
 
-from dossier import utils
-from dossier.spawners.kubernetes import DossierKubeSpawner
+from dossier import clients, utils
+from dossier.spawners import is_kube_spawner
+
+if TYPE_CHECKING:
+    from kubernetes_asyncio.client import CustomObjectsApi
+
+
+# Maximum number of page fragments cached by `_get_fragment`
+FRAGMENTS_CACHE_SIZE = 256
+
+# Invalidates the ETags of the previous hub processes, whose configuration and
+# templates may differ
+_ETAG_SALT = os.urandom(8).hex()
+
+_fragments: OrderedDict = OrderedDict()
+
+
+def _get_fragment(key):
+    if (fragment := _fragments.get(key)) is not None:
+        _fragments.move_to_end(key)
+    return fragment
+
+
+def _put_fragment(key, fragment):
+    _fragments[key] = fragment
+    while len(_fragments) > FRAGMENTS_CACHE_SIZE:
+        _fragments.popitem(last=False)
+    return fragment
+
+
+def _not_modified(handler, version, *parts):
+    """Set the validators of a page built from a reflected collection.
+
+    The ETag is derived from the collection `version`, as returned by
+    `utils.get_collection_version`, and from any other `parts` that the page
+    depends on. Return `True` if the client copy of the page is still valid."""
+    if version is None:
+        return False
+    collection_version, last_modified = version
+    etag = hashlib.sha1(
+        json.dumps([_ETAG_SALT, collection_version, *parts]).encode()
+    ).hexdigest()
+    handler.set_header("Etag", f'"{etag}"')
+    handler.set_header("Last-Modified", last_modified)
+    # Pages are user-specific, and must be revalidated on every visit
+    handler.set_header("Cache-Control", "private, no-cache")
+    return handler.check_etag_header()
 
 
 class DossierSpawnHandler(SpawnHandler):
@@ -25,18 +72,32 @@ class DossierSpawnHandler(SpawnHandler):
         **kwargs: Any,
     ):
         super().__init__(application, request, **kwargs)
-        load_config()
-        self.api: CustomObjectsApi = shared_client("CustomObjectsApi")
+        self.api: CustomObjectsApi = clients.custom_objects_api()
+
+    async def prepare(self):
+        utils.start_request_scope()
+        await super().prepare()
 
     async def _wrap_spawn_single_user(
         self, user, server_name, spawner, pending_url, options=None
     ):
-        if isinstance(spawner, DossierKubeSpawner) and spawner.tenant is None:
-            tenants = {
-                t["metadata"]["name"]: t for t in await utils.get_tenants(self.api)
-            }
-            user_groups = {g.name for g in user.orm_user.groups}
-            user_tenants = {t for t in tenants if t in user_groups}
+        if is_kube_spawner(spawner) and spawner.tenant is None:
+            # The default tenant is looked up alongside the user tenants, and its
+            # errors are only raised if it is actually needed. The user tenants
+            # lookup has usually been started by the options form already
+            user_tenants, *_ = await asyncio.gather(
+                utils.get_user_tenants(
+                    self.api, [g.name for g in user.orm_user.groups]
+                ),
+                *(
+                    [utils.get_tenant(self.api, spawner.default_tenant)]
+                    if spawner.default_tenant
+                    else []
+                ),
+                return_exceptions=True,
+            )
+            if isinstance(user_tenants, Exception):
+                raise user_tenants
             if len(user_tenants) == 0:
                 if spawner.default_tenant:
                     if self.log.isEnabledFor(logging.DEBUG):
@@ -44,8 +105,10 @@ class DossierSpawnHandler(SpawnHandler):
                             f"User '{user.escaped_name}' has no tenants assigned. "
                             f"Checking default tenant {spawner.default_tenant}."
                         )
-                    if spawner.default_tenant in tenants:
-                        spawner.tenant = tenants[spawner.default_tenant]
+                    if default_tenant := await utils.get_tenant(
+                        self.api, spawner.default_tenant
+                    ):
+                        spawner.tenant = default_tenant
                         spawner_options_form = await spawner.get_options_form()
                         if spawner_options_form:
                             self.log.debug(
@@ -70,7 +133,7 @@ class DossierSpawnHandler(SpawnHandler):
                     "no default tenant is defined.",
                 )
             elif len(user_tenants) == 1:
-                spawner.tenant = tenants[next(iter(user_tenants))]
+                spawner.tenant = next(iter(user_tenants.values()))
                 if self.log.isEnabledFor(logging.DEBUG):
                     self.log.debug(
                         f"User {user.name} has a single existing "
@@ -94,8 +157,7 @@ class DossierSpawnerHandler(BaseHandler):
         **kwargs: Any,
     ):
         super().__init__(application, request, **kwargs)
-        load_config()
-        self.api = shared_client("CustomObjectsApi")
+        self.api = clients.custom_objects_api()
 
     @web.authenticated
     async def get(self, user_name=None, server_name=""):
@@ -106,32 +168,53 @@ class DossierSpawnerHandler(BaseHandler):
             user = self.find_user(user_name)
             if user is None:
                 raise web.HTTPError(404, f"No such user: {user_name}")
-        spawners = {
-            t["metadata"]["name"]: t for t in await utils.get_spawners(self.api)
-        }
-        spawner_form_objs = [
-            {
-                "name": "Dossier Spawner",
-                "slug": "default",
-                "description": "Spawns a Notebook on your Kubernetes Tenant",
-            }
-        ]
-        for name in spawners:
-            annotations = spawners[name]["metadata"]["annotations"]
-            spawner_form_obj = {
-                "name": annotations.get("dossier.unito.it/display-name", name)
-            }
-            if "dossier.unito.it/description" in annotations:
-                spawner_form_obj["description"] = annotations[
-                    "dossier.unito.it/description"
-                ]
-            spawner_form_obj["slug"] = slugify(name)
-            spawner_form_objs.append(spawner_form_obj)
+        # Only Dossier spawners are bound to a tenant
+        tenant = getattr(user.spawners[server_name], "tenant", None)
+        tenant_name = tenant["metadata"]["name"] if tenant else None
         url = url_path_join(self.hub.base_url, "spawner", user.escaped_name)
+        version = utils.get_collection_version("spawners")
+        if _not_modified(
+            self,
+            version,
+            "spawners",
+            current_user.name,
+            current_user.admin,
+            user.name,
+            tenant_name,
+            url,
+        ):
+            self.set_status(304)
+            return self.finish()
+        key = ("spawners", tenant_name, version and version[0])
+        if (spawner_form_objs := version and _get_fragment(key)) is None:
+            spawners = {
+                t["metadata"]["name"]: t
+                for t in await utils.get_spawners(self.api, tenant_name)
+            }
+            spawner_form_objs = [
+                {
+                    "name": "Dossier Spawner",
+                    "slug": "default",
+                    "description": "Spawns a Notebook on your Kubernetes Tenant",
+                }
+            ]
+            for name in spawners:
+                annotations = spawners[name]["metadata"]["annotations"]
+                spawner_form_obj = {
+                    "name": annotations.get("dossier.unito.it/display-name", name)
+                }
+                if "dossier.unito.it/description" in annotations:
+                    spawner_form_obj["description"] = annotations[
+                        "dossier.unito.it/description"
+                    ]
+                spawner_form_obj["slug"] = slugify(name)
+                spawner_form_objs.append(spawner_form_obj)
+            if version:
+                _put_fragment(key, spawner_form_objs)
         html = await self.render_template(
             "spawners.html",
             url=url,
-            spawners=spawners,
+            spawners=spawner_form_objs,
         )
         return self.finish(html)
 
@@ -156,25 +239,20 @@ class DossierSpawnerHandler(BaseHandler):
             )
             self.redirect(next_url)
         elif s := await utils.get_spawner(self.api, spawner_name):
-            module_name, _, class_simplename = s["spec"]["class"].rpartition(".")
-            module = importlib.import_module(module_name)
-            class_ = getattr(module, class_simplename)
-            default_args = {
-                "cmd": spawner.cmd,
-                "args": spawner.args,
-                "env": spawner.env,
-                "user": spawner.user,
-                "db": spawner.db,
-                "hub": spawner.hub,
-                "authenticator": spawner.authenticator,
-                "oauth_client_id": spawner.oauth_client_id,
-                "orm_spawner": spawner.orm_spawner,
-                "proxy_spec": spawner.proxy_spec,
-                "server": spawner._server,
-                "config": spawner.config,
-            }
-            kwargs = {**default_args, **s["spec"]["parameters"]}
-            spawner.spawner = class_(**kwargs)
+            tenant = getattr(spawner, "tenant", None)
+            if tenant and not utils.is_spawner_enabled(s, tenant["metadata"]["name"]):
+                raise web.HTTPError(
+                    403,
+                    f"Spawner {spawner_name} is not enabled on "
+                    f"tenant {tenant['metadata']['name']}.",
+                )
+            try:
+                spawner_class = utils.get_spawner_class(s)
+            except Exception as e:
+                raise web.HTTPError(
+                    500, f"Spawner {spawner_name} has an invalid class: {e}"
+                )
+            spawner.spawner = spawner_class.create(spawner)
             next_url = self.get_next_url(
                 user, default=url_path_join(self.hub.base_url, "spawn")
             )
@@ -191,8 +269,7 @@ class DossierTenantHandler(BaseHandler):
         **kwargs: Any,
     ):
         super().__init__(application, request, **kwargs)
-        load_config()
-        self.api = shared_client("CustomObjectsApi")
+        self.api = clients.custom_objects_api()
 
     @web.authenticated
     async def get(self, user_name=None, server_name=""):
@@ -203,26 +280,41 @@ class DossierTenantHandler(BaseHandler):
             user = self.find_user(user_name)
             if user is None:
                 raise web.HTTPError(404, f"No such user: {user_name}")
-        tenants = {t["metadata"]["name"]: t for t in await utils.get_tenants(self.api)}
-        user_groups = {g.name for g in user.orm_user.groups}
-        user_tenants = {k: v for k, v in tenants.items() if k in user_groups}
-        tenant_form_objs = []
-        for name, tenant in user_tenants.items():
-            annotations = tenant["metadata"]["annotations"]
-            tenant_form_obj = {
-                "name": annotations.get("dossier.unito.it/display-name", name)
-            }
-            if "dossier.unito.it/description" in annotations:
-                tenant_form_obj["description"] = annotations[
-                    "dossier.unito.it/description"
-                ]
-            tenant_form_obj["slug"] = slugify(name)
-            tenant_form_objs.append(tenant_form_obj)
+        groups = sorted(g.name for g in user.orm_user.groups)
+        url = url_concat(self.request.uri, {"_xsrf": self.xsrf_token.decode("ascii")})
+        version = utils.get_collection_version("tenants")
+        if _not_modified(
+            self,
+            version,
+            "tenants",
+            current_user.name,
+            current_user.admin,
+            user.name,
+            groups,
+            url,
+        ):
+            self.set_status(304)
+            return self.finish()
+        key = ("tenants", tuple(groups), version and version[0])
+        if (tenant_form_objs := version and _get_fragment(key)) is None:
+            user_tenants = await utils.get_user_tenants(self.api, groups)
+            tenant_form_objs = []
+            for name, tenant in user_tenants.items():
+                annotations = tenant["metadata"]["annotations"]
+                tenant_form_obj = {
+                    "name": annotations.get("dossier.unito.it/display-name", name)
+                }
+                if "dossier.unito.it/description" in annotations:
+                    tenant_form_obj["description"] = annotations[
+                        "dossier.unito.it/description"
+                    ]
+                tenant_form_obj["slug"] = slugify(name)
+                tenant_form_objs.append(tenant_form_obj)
+            if version:
+                _put_fragment(key, tenant_form_objs)
         html = await self.render_template(
             "tenants.html",
-            url=url_concat(
-                self.request.uri, {"_xsrf": self.xsrf_token.decode("ascii")}
-            ),
+            url=url,
             tenants=tenant_form_objs,
         )
         await maybe_future(self.finish(html))
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import json
+import mimetypes
+import os
+
+from tornado.web import StaticFileHandler
+
+# Precompressed variants emitted by the build, by preference
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def _accepted_encodings(header):
+    encodings = set()
+    for item in header.split(","):
+        encoding, _, params = item.partition(";")
+        if params.strip().replace(" ", "") not in ("q=0", "q=0.0", "q=0.00"):
+            encodings.add(encoding.strip().lower())
+    return encodings
+
+
+class DossierStaticFileHandler(StaticFileHandler):
+    """Serves the Dossier static assets, as produced by the `static` build command.
+
+    When the client accepts it, the precompressed variant of an asset is served
+    as is. Fingerprinted assets, whose names contain a hash of their content, are
+    cached by clients forever."""
+
+    _manifests: dict[str, dict[str, str]] = {}
+
+    @classmethod
+    def get_manifest(cls, root):
+        """Return a dictionary of asset paths to their fingerprinted variants."""
+        if (manifest := cls._manifests.get(root)) is None:
+            try:
+                with open(os.path.join(root, "manifest.json")) as f:
+                    manifest = json.load(f)
+            except (FileNotFoundError, NotADirectoryError):
+                manifest = {}
+            cls._manifests[root] = manifest
+        return manifest
+
+    @classmethod
+    def make_static_url(cls, settings, path, include_version=True):
+        root = settings["static_path"]
+        if (fingerprinted := cls.get_manifest(root).get(path)) is not None:
+            return settings.get("static_url_prefix", "/static/") + fingerprinted
+        return super().make_static_url(settings, path, include_version)
+
+    def initialize(self, path, default_filename=None):
+        super().initialize(path, default_filename)
+        self.content_encoding = None
+
+    def validate_absolute_path(self, root, absolute_path):
+        absolute_path = super().validate_absolute_path(root, absolute_path)
+        if absolute_path is not None:
+            accepted = _accepted_encodings(
+                self.request.headers.get("Accept-Encoding", "")
+            )
+            for encoding, suffix in ENCODINGS:
+                if encoding in accepted and os.path.isfile(absolute_path + suffix):
+                    self.content_encoding = encoding
+                    return absolute_path + suffix
+        return absolute_path
+
+    def get_content_type(self):
+        if self.content_encoding is None:
+            return super().get_content_type()
+        mime_type, _ = mimetypes.guess_type(os.path.splitext(self.absolute_path)[0])
+        return mime_type or "application/octet-stream"
+
+    def get_cache_time(self, path, modified, mime_type):
+        if path in self.get_manifest(self.root).values():
+            return self.CACHE_MAX_AGE
+        return super().get_cache_time(path, modified, mime_type)
+
+    def set_extra_headers(self, path):
+        self.set_header("Vary", "Accept-Encoding")
+        if self.content_encoding is not None:
+            self.set_header("Content-Encoding", self.content_encoding)
+        if path in self.get_manifest(self.root).values():
+            self.set_header(
+                "Cache-Control", f"public, max-age={self.CACHE_MAX_AGE}, immutable"
+            )
+        elif "v" not in self.request.arguments:
+            self.set_header("Cache-Control", "no-cache")
@@ -0,0 +1,32 @@
+"""
+Prometheus metrics exported by Dossier
+
+Metrics are served by the JupyterHub `/hub/metrics` endpoint together with the
+JupyterHub ones, and follow the same naming conventions, with the `dossier_`
+prefix.
+"""
+
+from prometheus_client import Counter, Gauge
+
+KUBERNETES_COALESCED_REQUESTS = Counter(
+    "dossier_kubernetes_coalesced_requests_total",
+    "Kubernetes API reads served by an identical request already in flight",
+    ["plural", "verb"],
+)
+
+KUBERNETES_STALE_RESPONSES = Counter(
+    "dossier_kubernetes_stale_responses_total",
+    "Kubernetes API reads served from cached data while it is refreshed",
+    ["plural", "verb"],
+)
+
+KUBERNETES_REQUEST_FAILURES = Counter(
+    "dossier_kubernetes_request_failures_total",
+    "Kubernetes API reads failed because the API server was unavailable",
+    ["plural", "verb"],
+)
+
+KUBERNETES_CIRCUIT_OPEN = Gauge(
+    "dossier_kubernetes_circuit_open",
+    "Whether reads to the Kubernetes API server are suspended after repeated failures",
+)
@@ -0,0 +1,309 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from datetime import datetime, timezone
+
+from kubernetes_asyncio import watch
+from kubernetes_asyncio.client import ApiException
+from traitlets import Any, Bool, Dict, Float, Int, Unicode
+from traitlets.config import LoggingConfigurable
+
+
+class CustomObjectReflector(LoggingConfigurable):
+    """Keeps a local up-to-date copy of a set of cluster-scoped custom objects.
+
+    Objects are stored by name in the `resources` dictionary. The reflector
+    performs an initial list, then follows incremental watch events, keeping
+    track of the last seen `resourceVersion`. When the API server answers with
+    410 Gone, the stored version is too old and a full relist is performed.
+    """
+
+    api = Any(help="The `CustomObjectsApi` client used to list and watch objects.")
+
+    group = Unicode(help="API group of the watched custom objects.")
+
+    version = Unicode(help="API version of the watched custom objects.")
+
+    plural = Unicode(help="Plural name of the watched custom objects.")
+
+    resources = Dict(
+        {},
+        help="""
+        Dictionary of object names to the related custom objects.
+        """,
+    )
+
+    indexers = Dict(
+        {},
+        help="""
+        Dictionary of index names to functions that return the keys under which
+        an object should be indexed.
+
+        Indices are updated incrementally as objects are added, modified or
+        deleted, so that lookups by key never require a scan of the store.
+        """,
+    )
+
+    on_update = Any(
+        None,
+        allow_none=True,
+        help="""
+        Function called with each object added to or modified in the store.
+        """,
+    )
+
+    on_delete = Any(
+        None,
+        allow_none=True,
+        help="""
+        Function called with each object removed from the store.
+        """,
+    )
+
+    request_timeout = Int(
+        60,
+        config=True,
+        help="""
+        Network timeout for the Kubernetes watch.
+
+        Trigger watch reconnect when a given request is taking too long,
+        which can indicate network issues.
+        """,
+    )
+
+    timeout_seconds = Int(
+        300,
+        config=True,
+        help="""
+        Server-side timeout for the Kubernetes watch.
+
+        When it expires, the watch is restarted from the last seen resource version,
+        without performing a full relist.
+        """,
+    )
+
+    page_size = Int(
+        500,
+        config=True,
+        help="""
+        Number of objects requested per page during a full list.
+
+        Pages are applied to the local store as they arrive, so the whole list
+        is never held in memory at once.
+        """,
+    )
+
+    max_retry_delay = Float(
+        30,
+        config=True,
+        help="""
+        Maximum delay in seconds between two attempts to restore a failed watch.
+
+        Once the delay reaches this value, the local store is considered stale
+        and readers fall back to direct API calls until a relist succeeds.
+        Attempts continue until the reflector is stopped.
+        """,
+    )
+
+    synced = Bool(
+        False,
+        help="""
+        Whether the local store holds a consistent copy of the cluster objects.
+
+        Readers should fall back to direct API calls when this is `False`.
+        """,
+    )
+
+    _stopping = Bool(False)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.first_load_future = asyncio.Future()
+        self.indices = {index: {} for index in self.indexers}
+        self.resource_version = None
+        # Version and time of the last change to the store, ignoring bookmarks
+        self.collection_version = None
+        self.last_modified = None
+        self.watch_task = None
+
+    def _modified(self, resource_version):
+        self.collection_version = resource_version
+        self.last_modified = datetime.now(timezone.utc)
+
+    def _remove(self, name):
+        if (obj := self.resources.pop(name, None)) is not None:
+            for index, indexer in self.indexers.items():
+                for key in indexer(obj):
+                    bucket = self.indices[index].get(key, {})
+                    bucket.pop(name, None)
+                    if not bucket:
+                        self.indices[index].pop(key, None)
+        return obj
+
+    def _delete(self, name):
+        if (obj := self._remove(name)) is not None and self.on_delete is not None:
+            self.on_delete(obj)
+
+    def _update(self, obj):
+        name = obj["metadata"]["name"]
+        self._remove(name)
+        self.resources[name] = obj
+        for index, indexer in self.indexers.items():
+            for key in indexer(obj):
+                self.indices[index].setdefault(key, {})[name] = obj
+        if self.on_update is not None:
+            self.on_update(obj)
+
+    def by_index(self, index, key):
+        """Return the objects stored under `key` in the `index` index."""
+        return list(self.indices[index].get(key, {}).values())
+
+    async def _list_and_update(self):
+        """Update current list of objects by doing a full fetch.
+
+        Overwrites all current objects.
+        """
+        names = set()
+        _continue = None
+        while True:
+            objects = await self.api.list_cluster_custom_object(
+                group=self.group,
+                version=self.version,
+                plural=self.plural,
+                limit=self.page_size,
+                _continue=_continue,
+                _request_timeout=self.request_timeout,
+            )
+            for obj in objects["items"]:
+                names.add(obj["metadata"]["name"])
+                self._update(obj)
+            if not (_continue := objects["metadata"].get("continue")):
+                break
+        for name in set(self.resources) - names:
+            self._delete(name)
+        self._modified(objects["metadata"]["resourceVersion"])
+        self.synced = True
+        if not self.first_load_future.done():
+            self.first_load_future.set_result(None)
+        return objects["metadata"]["resourceVersion"]
+
+    async def _watch_and_update(self):
+        """Keeps the current list of objects up-to-date.
+
+        Watch events are applied incrementally. A full relist only happens when
+        the stored resource version expires (410 Gone) or after an error, to pick
+        up changes that might have been missed while the watch was down.
+        """
+        cur_delay = 0.1
+        self.log.info(f"Watching for {self.plural}.{self.group}")
+        while True:
+            w = watch.Watch()
+            try:
+                if self.resource_version is None:
+                    self.resource_version = await self._list_and_update()
+                async with w.stream(
+                    self.api.list_cluster_custom_object,
+                    group=self.group,
+                    version=self.version,
+                    plural=self.plural,
+                    resource_version=self.resource_version,
+                    allow_watch_bookmarks=True,
+                    timeout_seconds=self.timeout_seconds,
+                    _request_timeout=self.request_timeout + self.timeout_seconds,
+                ) as stream:
+                    async for event in stream:
+                        cur_delay = 0.1
+                        obj = event["raw_object"]
+                        if event["type"] == "DELETED":
+                            self._delete(obj["metadata"]["name"])
+                        elif event["type"] != "BOOKMARK":
+                            self._update(obj)
+                        self.resource_version = obj["metadata"]["resourceVersion"]
+                        if event["type"] != "BOOKMARK":
+                            self._modified(self.resource_version)
+                        if self._stopping:
+                            break
+            except asyncio.CancelledError:
+                self.log.debug(f"Cancelled watching {self.plural}.{self.group}")
+                raise
+            except asyncio.TimeoutError:
+                self.log.warning(
+                    f"Read timeout watching {self.plural}.{self.group}, reconnecting"
+                )
+                continue
+            except ApiException as e:
+                if e.status == 410:
+                    self.log.info(
+                        f"Resource version {self.resource_version} of "
+                        f"{self.plural}.{self.group} expired, relisting"
+                    )
+                    self.resource_version = None
+                    continue
+                cur_delay = await self._backoff(cur_delay)
+            except Exception:
+                cur_delay = await self._backoff(cur_delay)
+            finally:
+                w.stop()
+                await w.close()
+                if self._stopping:
+                    self.log.info(f"Watcher for {self.plural}.{self.group} stopped")
+                    break
+
+    async def _backoff(self, cur_delay):
+        # Ensure a full relist on retry, since events may have been lost
+        self.resource_version = None
+        cur_delay = min(cur_delay * 2, self.max_retry_delay)
+        if self.synced and cur_delay >= self.max_retry_delay:
+            self.log.error(
+                f"Watching {self.plural}.{self.group} is not recovering, falling "
+                "back to direct API calls until a relist succeeds"
+            )
+            self.synced = False
+        self.log.exception(
+            f"Error when watching {self.plural}.{self.group}, retrying in {cur_delay}s"
+        )
+        await asyncio.sleep(cur_delay)
+        return cur_delay
+
+    async def start(self, wait=True):
+        """Start the reflection process.
+
+        If `wait` is set, the initial list is awaited, so that callers can rely on
+        the local store as soon as this method returns. Otherwise, the initial
+        list is performed in the background, and retried until it succeeds.
+        """
+        if self.watch_task and not self.watch_task.done():
+            raise RuntimeError(
+                f"Task watching for {self.plural}.{self.group} is already running"
+            )
+        if not wait:
+            self.resource_version = None
+            self.watch_task = asyncio.create_task(self._watch_and_update())
+            return
+        start = time.perf_counter()
+        try:
+            self.resource_version = await self._list_and_update()
+        except Exception as e:
+            if not self.first_load_future.done():
+                self.first_load_future.set_exception(e)
+                # Callers get the error from this method, do not warn about it
+                self.first_load_future.exception()
+            raise
+        self.log.debug(
+            f"Loaded {len(self.resources)} {self.plural}.{self.group} "
+            f"in {time.perf_counter() - start:.3f} seconds"
+        )
+        self.watch_task = asyncio.create_task(self._watch_and_update())
+
+    async def stop(self):
+        """Cleanly shut down the watch task."""
+        self._stopping = True
+        self.synced = False
+        if self.watch_task and not self.watch_task.done():
+            self.watch_task.cancel()
+            try:
+                await asyncio.wait_for(self.watch_task, 5)
+            except (asyncio.CancelledError, asyncio.TimeoutError):
+                pass
+        self.watch_task = None
@@ -0,0 +1,8 @@
+import sys
+
+
+def is_kube_spawner(spawner):
+    """Return whether `spawner` is a `DossierKubeSpawner`, without importing
+    KubeSpawner when no such spawner was ever created."""
+    module = sys.modules.get("dossier.spawners.kubernetes")
+    return module is not None and isinstance(spawner, module.DossierKubeSpawner)
@@ -1,15 +1,58 @@
 from __future__ import annotations
 
+import json
+import math
+import re
+from collections import OrderedDict
+from fractions import Fraction
+from functools import lru_cache
 from typing import Any, MutableMapping
 
-from jinja2 import BaseLoader, Environment
+from jinja2 import Environment, FileSystemBytecodeCache, FunctionLoader
 from jupyterhub.utils import maybe_future, url_path_join
 from kubespawner import KubeSpawner
-from kubespawner.clients import shared_client
 from tornado.web import Finish
-from traitlets.traitlets import Unicode
+from traitlets import observe
+from traitlets.traitlets import Integer, Unicode
 
-from dossier import utils
+from dossier import clients, utils
+
+
+# Multipliers of the Kubernetes quantity suffixes, see
+# https://kubernetes.io/docs/reference/kubernetes-api/common-definitions/quantity/
+_QUANTITY_SUFFIXES = {
+    "Ki": 2**10,
+    "Mi": 2**20,
+    "Gi": 2**30,
+    "Ti": 2**40,
+    "Pi": 2**50,
+    "Ei": 2**60,
+    "n": Fraction(1, 10**9),
+    "u": Fraction(1, 10**6),
+    "m": Fraction(1, 10**3),
+    "": 1,
+    "k": 10**3,
+    "M": 10**6,
+    "G": 10**9,
+    "T": 10**12,
+    "P": 10**15,
+    "E": 10**18,
+}
+
+_QUANTITY_PATTERN = re.compile(
+    r"([+-]?(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+))"
+    r"(?:[eE]([+-]?[0-9]+)|(" + "|".join(_QUANTITY_SUFFIXES) + r"))"
+)
+
+
+@lru_cache(maxsize=1024)
+def _parse_quantity(value: str) -> Fraction:
+    if (match := _QUANTITY_PATTERN.fullmatch(value.strip())) is None:
+        raise ValueError(f"Invalid resource quantity {value}.")
+    number, exponent, suffix = match.groups()
+    if exponent is not None:
+        return Fraction(number) * Fraction(10) ** int(exponent)
+    return Fraction(number) * _QUANTITY_SUFFIXES[suffix]
 
 
 def _get_resource_amount(value, unit):
@@ -23,60 +66,110 @@ def _get_resource_amount(value, unit):
 
 def _get_resource_amount_in_elements(value):
     if value:
-        v = str(value)
-        if v.endswith("m"):
-            return float(int(v[:-1]) / 1000)
-        else:
-            return int(v)
+        amount = _parse_quantity(str(value))
+        return int(amount) if amount.denominator == 1 else float(amount)
     else:
         return 0
 
 
 def _get_resource_amount_in_bytes(value):
     if value:
-        v = str(value)
-        if v.endswith("m"):
-            return int(v[:-1]) / 1000
-        else:
-            base = 10
-            exponent = 3
-            if v.endswith("i"):
-                base = 2
-                exponent = 10
-                v = v[:-1]
-            if v.endswith("k"):
-                multiplier = base**exponent
-                v = v[:-1]
-            elif v.endswith("M"):
-                multiplier = base ** (2 * exponent)
-                v = v[:-1]
-            elif v.endswith("G"):
-                multiplier = base ** (3 * exponent)
-                v = v[:-1]
-            elif v.endswith("T"):
-                multiplier = base ** (4 * exponent)
-                v = v[:-1]
-            elif v.endswith("P"):
-                multiplier = base ** (5 * exponent)
-                v = v[:-1]
-            elif v.endswith("E"):
-                multiplier = base ** (6 * exponent)
-                v = v[:-1]
-            else:
-                multiplier = 1
-            return int(v) * multiplier
+        # Fractional bytes are rounded up, as Kubernetes does
+        return math.ceil(_parse_quantity(str(value)))
     else:
         return 0
 
 
+def _get_limit_amounts(limit, units):
+    """Parse all the quantities of a LimitRange item at once.
+
+    Return a dictionary with the same structure of the `limit` item, e.g.,
+    `{"default": {"cpu": 0.5}}`, where each quantity is converted according to
+    the `units` of its resource. Resources not listed in `units` are skipped."""
+    return {
+        key: {
+            r: _get_resource_amount(quantity, units[r])
+            for r, quantity in limit.get(key, {}).items()
+            if r in units
+        }
+        for key in ("default", "defaultRequest", "min", "max")
+    }
+
+
+def _get_spawn_profile(tenant):
+    # Resources offered in the options form, with their limits
+    resources = {
+        "cpu": {
+            "name": "cpu",
+            "display_name": "CPU",
+            "unit": "element",
+            "step": 10,
+        },
+        "memory": {"name": "memory", "display_name": "Memory", "unit": "byte"},
+        "nvidia.com/gpu": {
+            "name": "gpu",
+            "display_name": "GPU",
+            "unit": "element",
+            "step": 1,
+        },
+    }
+    # Default container limits and requests, used when the options form is skipped
+    container_limits = None
+    for item in tenant["spec"].get("limitRanges", {}).get("items", []):
+        for limit in item.get("limits", []):
+            if limit.get("type") == "Container":
+                amounts = _get_limit_amounts(
+                    limit, {r: resources[r]["unit"] for r in resources}
+                )
+                for r in resources:
+                    for key in ("default", "min", "max"):
+                        if r in amounts[key]:
+                            resources[r][key] = amounts[key][r]
+                container_limits = {
+                    key: {
+                        r: v for r, v in amounts[key].items() if r in ("cpu", "memory")
+                    }
+                    for key in ("default", "defaultRequest")
+                }
+                break
+    else:
+        for r in resources:
+            resources[r]["min"] = 0
+    return {"resources": list(resources.values()), "container_limits": container_limits}
+
+
+def _tenant_cache_key(tenant):
+    metadata = tenant["metadata"]
+    if (resource_version := metadata.get("resourceVersion")) is None:
+        return None
+    return metadata["name"], resource_version
+
+
+@lru_cache(maxsize=None)
+def _get_options_form_environment(bytecode_cache_dir=None):
+    # Templates are loaded by source, so that each distinct template string is
+    # compiled once and shared by all spawners
+    return Environment(
+        loader=FunctionLoader(lambda source: source),
+        bytecode_cache=(
+            FileSystemBytecodeCache(bytecode_cache_dir) if bytecode_cache_dir else None
+        ),
+    )
+
+
 class DossierKubeSpawner(KubeSpawner):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self._options_form_config_key = None
+        self._options_form_template = None
         self._original_namespace = self.namespace
-        self.custom_api = shared_client("CustomObjectsApi")
         self.spawner = None
         self.tenant: MutableMapping[str, Any] | None = None
 
+    @property
+    def custom_api(self):
+        return clients.custom_objects_api()
+
     default_image_policy = Unicode(
         "fixed",
         config=True,
@@ -201,10 +294,106 @@ class DossierKubeSpawner(KubeSpawner):
             """,
     )
 
+    dossier_options_form_bytecode_cache_dir = Unicode(
+        None,
+        config=True,
+        allow_none=True,
+        help="""
+        Directory where the compiled `dossier_options_form_template` is cached.
+
+        If not configured, the template is compiled in memory once per process.
+        The directory must already exist.
+        """,
+    )
+
+    options_form_cache_size = Integer(
+        128,
+        config=True,
+        help="""
+        Maximum number of tenants whose spawn profile and rendered options form
+        are cached.
+
+        Cached entries are keyed by the tenant `resourceVersion`, so they are never
+        served after a tenant changes. The least recently used ones are evicted
+        first.
+        """,
+    )
+
+    # Spawn profiles and rendered options forms, shared by all spawners
+    _spawn_profiles: OrderedDict = OrderedDict()
+    _options_forms: OrderedDict = OrderedDict()
+
+    @observe("dossier_options_form_template", "dossier_options_form_bytecode_cache_dir")
+    def _options_form_template_changed(self, change):
+        self._options_form_template = None
+
+    @observe(
+        "additional_profile_form_template_paths",
+        "default_image_policy",
+        "default_resource_policy",
+        "dossier_options_form_template",
+        "image",
+        "profile_form_template",
+        "profile_list",
+    )
+    def _options_form_config_changed(self, change):
+        self._options_form_config_key = None
+
+    def _get_options_form_config_key(self):
+        if self._options_form_config_key is None:
+            self._options_form_config_key = json.dumps(
+                [
+                    self.additional_profile_form_template_paths,
+                    self.default_image_policy,
+                    self.default_resource_policy,
+                    self.dossier_options_form_template,
+                    self.image,
+                    self.profile_form_template,
+                    self.profile_list,
+                ],
+                default=repr,
+            )
+        return self._options_form_config_key
+
+    def _cache_get(self, cache, key):
+        if key is not None and (value := cache.get(key)) is not None:
+            cache.move_to_end(key)
+            return value
+        return None
+
+    def _cache_put(self, cache, key, value):
+        if key is not None:
+            cache[key] = value
+            while len(cache) > self.options_form_cache_size:
+                cache.popitem(last=False)
+        return value
+
+    def _get_spawn_profile(self):
+        key = _tenant_cache_key(self.tenant)
+        if (profile := self._cache_get(self._spawn_profiles, key)) is None:
+            profile = self._cache_put(
+                self._spawn_profiles, key, _get_spawn_profile(self.tenant)
+            )
+        return profile
+
+    def _get_options_form_template(self):
+        if self._options_form_template is None:
+            self._options_form_template = _get_options_form_environment(
+                self.dossier_options_form_bytecode_cache_dir
+            ).get_template(self.dossier_options_form_template)
+        return self._options_form_template
+
     async def _get_options_form(self):
         # If tenant has not been configured yet, skip the options form
         if self.tenant is None:
             return None
+        # Dynamic profile lists depend on the user, so their forms are not cached
+        if callable(self.profile_list):
+            key = None
+        elif (key := _tenant_cache_key(self.tenant)) is not None:
+            key = (*key, self._get_options_form_config_key())
+            if (form := self._cache_get(self._options_forms, key)) is not None:
+                return form or None
         # Retrieve annotations from tenant metadata
         annotations = self.tenant["metadata"]["annotations"]
         image_policy = annotations.get(
@@ -226,51 +415,20 @@ class DossierKubeSpawner(KubeSpawner):
             and resource_policy == "fixed"
             and not profile_options_form
         ):
+            # An empty string records that no form is needed for this tenant
+            self._cache_put(self._options_forms, key, "")
             return None
-        dossier_form_template = Environment(loader=BaseLoader()).from_string(
-            self.dossier_options_form_template
-        )
-        resources = {
-            "cpu": {
-                "name": "cpu",
-                "display_name": "CPU",
-                "unit": "element",
-                "step": 10,
-            },
-            "memory": {"name": "memory", "display_name": "Memory", "unit": "byte"},
-            "nvidia.com/gpu": {
-                "name": "gpu",
-                "display_name": "GPU",
-                "unit": "element",
-                "step": 1,
-            },
-        }
-        for item in self.tenant["spec"].get("limitRanges", {}).get("items", []):
-            for limit in item.get("limits", []):
-                if limit.get("type") == "Container":
-                    for r in resources:
-                        if r in limit.get("default", {}):
-                            resources[r]["default"] = _get_resource_amount(
-                                limit["default"][r], resources[r]["unit"]
-                            )
-                        if r in limit.get("min", {}):
-                            resources[r]["min"] = _get_resource_amount(
-                                limit["min"][r], resources[r]["unit"]
-                            )
-                        if r in limit.get("max", {}):
-                            resources[r]["max"] = _get_resource_amount(
-                                limit["max"][r], resources[r]["unit"]
-                            )
-                    break
-        else:
-            for r in resources:
-                resources[r]["min"] = 0
-        return dossier_form_template.render(
-            image_policy=image_policy,
-            profile_options_form=profile_options_form,
-            default_image=self.image,
-            resource_policy=resource_policy,
-            resources=list(resources.values()),
+        dossier_form_template = self._get_options_form_template()
+        return self._cache_put(
+            self._options_forms,
+            key,
+            dossier_form_template.render(
+                image_policy=image_policy,
+                profile_options_form=profile_options_form,
+                default_image=self.image,
+                resource_policy=resource_policy,
+                resources=self._get_spawn_profile()["resources"],
+            ),
         )
 
     async def _start(self):
@@ -281,9 +439,20 @@ class DossierKubeSpawner(KubeSpawner):
 
     async def get_options_form(self):
         if self.spawner is None:
+            if self.tenant is None:
+                # The spawn handler looks up the tenants of the user right after
+                # the options form, so both lookups are started together
+                utils.prefetch(
+                    utils.get_user_tenants(
+                        self.custom_api, [g.name for g in self.user.orm_user.groups]
+                    )
+                )
             spawners = {
                 t["metadata"]["name"]: t
-                for t in await utils.get_spawners(self.custom_api)
+                for t in await utils.get_spawners(
+                    self.custom_api,
+                    self.tenant["metadata"]["name"] if self.tenant else None,
+                )
             }
             if len(spawners) == 0:
                 self.spawner = self
@@ -331,36 +500,24 @@ class DossierKubeSpawner(KubeSpawner):
                     "mem_guarantee": int(formdata.get("mem")[0]) or self.mem_guarantee,
                 }
             )
-        else:
-            for item in self.tenant["spec"].get("limitRanges", {}).get("items", []):
-                for limit in item.get("limits", []):
-                    if limit.get("type") == "Container":
-                        profile["kubespawner_override"].update(
-                            {
-                                "cpu_limit": _get_resource_amount(
-                                    limit.get("default", {}).get("cpu", self.cpu_limit),
-                                    "element",
-                                ),
-                                "cpu_guarantee": _get_resource_amount(
-                                    limit.get("defaultRequest", {}).get(
-                                        "cpu", self.cpu_limit
-                                    ),
-                                    "element",
-                                ),
-                                "mem_limit": _get_resource_amount(
-                                    limit.get("default", {}).get(
-                                        "memory", self.mem_limit
-                                    ),
-                                    "byte",
-                                ),
-                                "mem_guarantee": _get_resource_amount(
-                                    limit.get("defaultRequest", {}).get(
-                                        "memory", self.mem_guarantee
-                                    ),
-                                    "byte",
-                                ),
-                            }
-                        )
-                        break
+        elif (limits := self._get_spawn_profile()["container_limits"]) is not None:
+
+            def amount(key, resource, unit, fallback):
+                if resource in limits[key]:
+                    return limits[key][resource]
+                return _get_resource_amount(fallback, unit)
+
+            profile["kubespawner_override"].update(
+                {
+                    "cpu_limit": amount("default", "cpu", "element", self.cpu_limit),
+                    "cpu_guarantee": amount(
+                        "defaultRequest", "cpu", "element", self.cpu_limit
+                    ),
+                    "mem_limit": amount("default", "memory", "byte", self.mem_limit),
+                    "mem_guarantee": amount(
+                        "defaultRequest", "memory", "byte", self.mem_guarantee
+                    ),
+                }
+            )
         self.log.debug("Launching profile " + str(profile))
         return {"profile": profile}
@@ -1,19 +1,724 @@
 from __future__ import annotations
 
+import asyncio
+import base64
 import os
-import shutil
-from tempfile import TemporaryDirectory
+import random
+import shlex
+import time
+from contextlib import asynccontextmanager
+from functools import lru_cache
 from textwrap import dedent
+from urllib.parse import urlsplit, urlunsplit
 
 import asyncssh
 from jupyterhub.spawner import Spawner
 from jupyterhub.utils import url_path_join
-from traitlets.traitlets import Bool, Dict, Integer, Unicode
+from traitlets.config import LoggingConfigurable
+from traitlets.traitlets import Any, Bool, Dict, Float, Integer, List, Unicode
+
+
+def _remote_path(path):
+    # Quote a remote path, leaving a leading `~` to be expanded by the remote shell
+    if path == "~" or path.startswith("~/"):
+        return '"$HOME"' + (f"/{shlex.quote(path[2:])}" if path[2:] else "")
+    return shlex.quote(path)
+
+
+def _shell_value(value):
+    # Quote an environment value, expanding `~` like bash does in assignments
+    return ":".join(_remote_path(v) for v in str(value).split(":"))
+
+
+def _service_url_export(url):
+    # The notebook binds the port of its service URL, which must follow the port
+    # actually selected by the launch script
+    parts = urlsplit(url)
+    if parts.port is None:
+        return f"export JUPYTERHUB_SERVICE_URL={shlex.quote(url)}\n"
+    netloc = parts.netloc.rpartition(":")[0] + ":"
+    prefix = urlunsplit((parts.scheme, netloc, "", "", ""))
+    suffix = urlunsplit(("", "", parts.path, parts.query, parts.fragment))
+    return (
+        f"export JUPYTERHUB_SERVICE_URL={shlex.quote(prefix)}"
+        f'"$port"{shlex.quote(suffix) if suffix else ""}\n'
+    )
+
+
+@lru_cache(maxsize=32)
+def _launch_script_template(remote_port_command, command):
+    prologue = 'if [ -z "$port" ] || (exec 3<>"/dev/tcp/127.0.0.1/$port") 2>/dev/null\n'
+    prologue += f"then port=$({remote_port_command}); fi\n"
+    prologue += 'if [ -z "$port" ]; then exit 1; fi\n'
+    epilogue = "unset XDG_RUNTIME_DIR\n"
+    epilogue += "touch .jupyter.log\n"
+    epilogue += "chmod 600 .jupyter.log\n"
+    epilogue += "%s < /dev/null >> .jupyter.log 2>&1 & pid=$!\n" % command
+    epilogue += "echo $port $pid\n"
+    return prologue, epilogue
+
+
+def _read_file(path):
+    with open(path, "rb") as fd:
+        return fd.read()
+
+
+def _stage_files_script(files):
+    script = ""
+    for d in sorted({os.path.dirname(p) for p in files}):
+        script += f"mkdir -p {_remote_path(d)} 2>/dev/null\n"
+    for path, content in files.items():
+        script += (
+            f"(umask 077 && base64 -d > {_remote_path(path + '.tmp')} && "
+            f"mv -f {_remote_path(path + '.tmp')} {_remote_path(path)}) "
+            "<<'DOSSIER_EOF'\n"
+            f"{base64.b64encode(content).decode('ascii')}\n"
+            "DOSSIER_EOF\n"
+        )
+    return script
+
+
+def _ps_alive(pids):
+    # List the running processes among `pids`, excluding zombies
+    return f"ps -o pid=,stat= -p {pids} | awk '$2 !~ /^Z/ {{print $1}}'"
+
+
+class _CachedCredential:
+    def __init__(self, mtimes, key, certificate):
+        self.mtimes = mtimes
+        self.client_keys = [(key, certificate)]
+        # OpenSSH certificates expose their expiry time only as a private attribute
+        self.valid_before = getattr(certificate, "_valid_before", None)
+
+
+class SSHCredentialCache:
+    """A cache of SSH private keys and certificates, keyed by the key file path.
+
+    Entries are reloaded when either file changes its modification time or when
+    the certificate expires. All file system accesses run in the default executor,
+    so that a slow file system does not stall the event loop."""
+
+    def __init__(self):
+        self._credentials: dict[str, _CachedCredential] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    @staticmethod
+    def _mtimes(kf, cf):
+        return os.stat(kf).st_mtime_ns, os.stat(cf).st_mtime_ns
+
+    @staticmethod
+    def _load(kf, cf):
+        return (
+            SSHCredentialCache._mtimes(kf, cf),
+            asyncssh.read_private_key(kf),
+            asyncssh.read_certificate(cf),
+        )
+
+    async def get(self, keyfile):
+        """Return the `(key, certificate)` client keys for `keyfile`.
+
+        The certificate is expected in the `-cert.pub` file next to the key."""
+        kf = os.path.expanduser(keyfile)
+        cf = kf + "-cert.pub"
+        loop = asyncio.get_running_loop()
+        async with self._locks.setdefault(kf, asyncio.Lock()):
+            mtimes = await loop.run_in_executor(None, self._mtimes, kf, cf)
+            entry = self._credentials.get(kf)
+            if (
+                entry is None
+                or entry.mtimes != mtimes
+                or (
+                    entry.valid_before is not None and time.time() >= entry.valid_before
+                )
+            ):
+                entry = _CachedCredential(
+                    *(await loop.run_in_executor(None, self._load, kf, cf))
+                )
+                self._credentials[kf] = entry
+            return entry.client_keys
+
+
+class _PooledConnection:
+    def __init__(self, conn):
+        self.conn = conn
+        self.closed = False
+        self.last_used = time.monotonic()
+        self.users = 0
+
+
+class SSHConnectionPool(LoggingConfigurable):
+    """A hub-wide pool of SSH connections, shared by all `SSHSpawner` instances.
+
+    Connections are keyed by remote host, remote user and credential. Each spawner
+    operation runs as a separate channel on a pooled connection, so that the SSH
+    handshake is paid once per key instead of once per operation."""
+
+    max_size = Integer(
+        64,
+        config=True,
+        help=dedent(
+            """Maximum number of pooled connections.
+
+            When the pool is full, the least recently used idle connection is
+            evicted. If all connections are in use, a temporary connection is
+            opened and closed as soon as the operation completes."""
+        ),
+    )
+
+    idle_timeout = Float(
+        300,
+        config=True,
+        help="Seconds after which an unused connection is closed",
+    )
+
+    keepalive_interval = Float(
+        30,
+        config=True,
+        help=dedent(
+            """Seconds between SSH keepalive messages on pooled connections.
+
+            Connections that do not answer `keepalive_count_max` consecutive
+            keepalives are closed and removed from the pool."""
+        ),
+    )
+
+    keepalive_count_max = Integer(
+        3, config=True, help="Maximum number of unanswered keepalive messages"
+    )
+
+    connect_timeout = Float(
+        30, config=True, help="Timeout in seconds for establishing a connection"
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._connections: dict[tuple, _PooledConnection] = {}
+        self._locks: dict[tuple, asyncio.Lock] = {}
+        self._reaper = None
+
+    async def _connect(self, host, username, client_keys):
+        self.log.debug(f"Opening SSH connection to {username}@{host}")
+        return await asyncssh.connect(
+            host,
+            username=username,
+            client_keys=client_keys,
+            known_hosts=None,
+            connect_timeout=self.connect_timeout,
+            keepalive_interval=self.keepalive_interval,
+            keepalive_count_max=self.keepalive_count_max,
+        )
+
+    def _discard(self, key, entry):
+        entry.closed = True
+        if self._connections.get(key) is entry:
+            del self._connections[key]
+
+    def _evict(self):
+        idle = [(e.last_used, k) for k, e in self._connections.items() if not e.users]
+        if idle:
+            key = min(idle)[1]
+            self.log.debug(f"Evicting SSH connection to {key[1]}@{key[0]}")
+            self._connections.pop(key).conn.close()
+            return True
+        return False
+
+    async def _reap(self):
+        while self._connections:
+            await asyncio.sleep(self.idle_timeout / 2)
+            deadline = time.monotonic() - self.idle_timeout
+            for key, entry in list(self._connections.items()):
+                if not entry.users and entry.last_used < deadline:
+                    self.log.debug(f"Closing idle SSH connection to {key[1]}@{key[0]}")
+                    self._discard(key, entry)
+                    entry.conn.close()
+        self._reaper = None
+
+    async def _acquire(self, host, username, client_keys, credential_id):
+        key = (host, username, credential_id)
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            if (entry := self._connections.get(key)) is not None and not entry.closed:
+                return entry, True
+            if len(self._connections) >= self.max_size and not self._evict():
+                self.log.warning(
+                    f"SSH connection pool is full, opening a temporary connection "
+                    f"to {username}@{host}"
+                )
+                return (
+                    _PooledConnection(await self._connect(host, username, client_keys)),
+                    False,
+                )
+            entry = _PooledConnection(await self._connect(host, username, client_keys))
+            self._connections[key] = entry
+            asyncio.ensure_future(entry.conn.wait_closed()).add_done_callback(
+                lambda _: self._discard(key, entry)
+            )
+            if self._reaper is None:
+                self._reaper = asyncio.create_task(self._reap())
+            return entry, True
+
+    @asynccontextmanager
+    async def _borrow(self, host, username, client_keys, credential_id):
+        entry, pooled = await self._acquire(host, username, client_keys, credential_id)
+        entry.users += 1
+        try:
+            yield entry, pooled
+        finally:
+            entry.users -= 1
+            entry.last_used = time.monotonic()
+            # Discarded connections are closed once their last borrower is done
+            if not pooled or (entry.closed and not entry.users):
+                entry.conn.close()
+
+    @asynccontextmanager
+    async def connection(self, host, username, client_keys, credential_id):
+        """Borrow a connection to `username@host` authenticated with `client_keys`.
+
+        The `credential_id` uniquely identifies the credential, and is part of
+        the pool key together with host and username."""
+        async with self._borrow(host, username, client_keys, credential_id) as (
+            entry,
+            _,
+        ):
+            yield entry.conn
+
+    async def run(self, host, username, client_keys, credential_id, command, **kwargs):
+        """Run `command` on a pooled connection to `username@host`.
+
+        If the pooled connection turns out to be broken, it is discarded and the
+        command is retried once on a fresh connection. If the connection is
+        healthy but refuses a new channel, e.g., because of the `MaxSessions`
+        limit of the SSH server, the command runs on a temporary connection."""
+        key = (host, username, credential_id)
+        for attempt in range(2):
+            async with self._borrow(host, username, client_keys, credential_id) as (
+                entry,
+                pooled,
+            ):
+                try:
+                    return await entry.conn.run(command, **kwargs)
+                except asyncssh.ConnectionLost:
+                    if attempt or not pooled:
+                        raise
+                    self._discard(key, entry)
+                    self.log.debug(
+                        f"Stale SSH connection to {username}@{host}, retrying"
+                    )
+                except asyncssh.ChannelOpenError:
+                    if not pooled or entry.closed:
+                        raise
+                    self.log.debug(
+                        f"SSH connection to {username}@{host} refused a new "
+                        f"channel, running on a temporary connection"
+                    )
+                    async with await self._connect(host, username, client_keys) as conn:
+                        return await conn.run(command, **kwargs)
+
+    async def close(self):
+        """Close all pooled connections."""
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        for key, entry in list(self._connections.items()):
+            self._discard(key, entry)
+            entry.conn.close()
+
+
+class SSHHostPoller(LoggingConfigurable):
+    """Checks the liveness of all the notebooks running on a remote host at once.
+
+    Spawners register the PID of their notebook together with a function to run
+    commands on the host. A single remote command checks all registered PIDs, and
+    its result is shared by all the `poll()` calls received within `max_age`
+    seconds. Each remote account of each host has its own poller, so that
+    processes are always checked by their owner, even when the host hides other
+    users' processes, and a slow host does not delay the others."""
+
+    host = Unicode(help="The remote host where the polled processes run")
+
+    username = Unicode(help="The remote user that owns the polled processes")
+
+    max_age = Float(
+        10,
+        config=True,
+        help="Seconds for which the result of a liveness check is reused",
+    )
+
+    timeout = Float(
+        30,
+        config=True,
+        help="Timeout in seconds for the remote liveness check",
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._runners = {}
+        self._alive = set()
+        self._checked = set()
+        self._last_check = 0.0
+        self._refresh = None
+
+    def register(self, pid, runner):
+        """Include `pid` in the next checks, running them through `runner`."""
+        self._runners[pid] = runner
+
+    def unregister(self, pid):
+        self._runners.pop(pid, None)
+
+    async def _check(self):
+        pids = list(self._runners)
+        runner = self._runners[pids[-1]]
+        result = await asyncio.wait_for(
+            runner(_ps_alive(",".join(str(p) for p in pids))), self.timeout
+        )
+        self._alive = {int(p) for p in result.stdout.split()}
+        self._checked = set(pids)
+        self._last_check = time.monotonic()
+        self.log.debug(
+            f"Checked {len(pids)} processes of {self.username} on {self.host}, "
+            f"{len(self._alive)} alive"
+        )
+
+    def _done(self, future):
+        if self._refresh is future:
+            self._refresh = None
+
+    async def is_alive(self, pid):
+        """Return whether `pid` is running, or `None` if the check failed."""
+        if pid in self._checked and time.monotonic() - self._last_check <= self.max_age:
+            return pid in self._alive
+        while pid in self._runners:
+            if self._refresh is None:
+                self._refresh = asyncio.ensure_future(self._check())
+                self._refresh.add_done_callback(self._done)
+            refresh = self._refresh
+            try:
+                await asyncio.shield(refresh)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.log.exception(f"Failed to check processes on {self.host}")
+                return None
+            # A check already in flight when `pid` was registered does not include it
+            if pid in self._checked:
+                return pid in self._alive
+        return None
+
+
+class SSHHostStopper(LoggingConfigurable):
+    """Stops the notebooks running on a remote host in batches.
+
+    Stop requests received within `batch_delay` seconds are grouped, and a single
+    remote command sends SIGTERM to all their processes, waits for them to exit,
+    and escalates to SIGKILL after `kill_timeout` seconds. Each remote account
+    of each host has its own stopper, so that signals are always sent with the
+    credentials of the process owner, and hosts are drained in parallel."""
+
+    host = Unicode(help="The remote host where the stopped processes run")
+
+    username = Unicode(help="The remote user that owns the stopped processes")
+
+    batch_delay = Float(
+        0.1,
+        config=True,
+        help="Seconds to wait for other stop requests before stopping a batch",
+    )
+
+    kill_timeout = Float(
+        10,
+        config=True,
+        help="Seconds to wait after SIGTERM before sending SIGKILL",
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._pending: dict[int, asyncio.Future] = {}
+        self._runner = None
+        self._flush_task = None
+
+    def _script(self, pids):
+        # Print the processes killed with SIGKILL, then the ones still running
+        ps_pids = ",".join(str(p) for p in pids)
+        steps = max(int(self.kill_timeout * 10), 1)
+        return (
+            f"kill -s TERM {' '.join(str(p) for p in pids)}\n"
+            f"for ((i = 0; i < {steps}; i++)); do\n"
+            f"  alive=$({_ps_alive(ps_pids)})\n"
+            '  if [ -z "$alive" ]; then break; fi\n'
+            "  sleep 0.1\n"
+            "done\n"
+            'killed="$alive"\n'
+            'if [ -n "$alive" ]; then\n'
+            "  kill -s KILL $alive\n"
+            "  for ((i = 0; i < 10; i++)); do\n"
+            f"    alive=$({_ps_alive(ps_pids)})\n"
+            '    if [ -z "$alive" ]; then break; fi\n'
+            "    sleep 0.1\n"
+            "  done\n"
+            "fi\n"
+            "echo $killed\n"
+            "echo $alive\n"
+        )
+
+    async def _flush(self):
+        await asyncio.sleep(self.batch_delay)
+        pending, self._pending = self._pending, {}
+        self._flush_task = None
+        pids = list(pending)
+        try:
+            result = await asyncio.wait_for(
+                self._runner("bash -s", input=self._script(pids)),
+                self.kill_timeout + 30,
+            )
+            lines = result.stdout.split("\n")
+            killed = {int(p) for p in lines[0].split()}
+            alive = {int(p) for p in lines[1].split()} if len(lines) > 1 else set()
+            if alive:
+                self.log.warning(
+                    f"Failed to stop {len(alive)} processes of {self.username} "
+                    f"on {self.host}: {result.stderr.strip()}"
+                )
+            self.log.info(
+                f"Stopped {len(pids) - len(alive)} processes of {self.username} on "
+                f"{self.host}, {len(killed - alive)} of which with SIGKILL"
+            )
+            for pid, future in pending.items():
+                if pid in alive:
+                    future.set_exception(
+                        RuntimeError(f"Process {pid} on {self.host} is still running")
+                    )
+                else:
+                    future.set_result("killed" if pid in killed else "terminated")
+        except Exception as e:
+            for future in pending.values():
+                future.set_exception(e)
+
+    async def stop(self, pid, runner):
+        """Stop `pid`, running the batched command through `runner`.
+
+        Return `"terminated"` if the process exited after SIGTERM, or `"killed"`
+        if it had to be killed. Raise an error if the process is still running,
+        e.g., because it cannot be signalled with the credentials of `runner`."""
+        if pid <= 0:
+            # kill would signal a whole process group, or all the user processes
+            raise ValueError(f"Invalid process ID {pid}")
+        if pid not in self._pending:
+            self._pending[pid] = asyncio.get_running_loop().create_future()
+        future = self._pending[pid]
+        self._runner = runner
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush())
+        return await future
+
+
+class SSHPortAllocator(LoggingConfigurable):
+    """Hands out the ports of single-user servers on remote hosts.
+
+    The allocator keeps a table of the ports leased on each remote host, so that
+    the hub can pick a port without querying the host and without handing the
+    same port to two concurrent spawns. The launch script falls back to
+    `SSHSpawner.remote_port_command` only if the leased port is already bound."""
+
+    min_port = Integer(
+        49152, config=True, help="Lowest port that can be leased on a remote host"
+    )
+
+    max_port = Integer(
+        65535, config=True, help="Highest port that can be leased on a remote host"
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._leases: dict[str, set[int]] = {}
+
+    def lease(self, host):
+        """Lease a free port on `host`."""
+        leases = self._leases.setdefault(host, set())
+        if len(leases) > self.max_port - self.min_port:
+            raise RuntimeError(f"No free ports left on remote host {host}")
+        while (port := random.randint(self.min_port, self.max_port)) in leases:
+            pass
+        leases.add(port)
+        return port
+
+    def restore(self, host, port):
+        """Record a lease restored from a spawner state."""
+        self._leases.setdefault(host, set()).add(port)
+
+    def release(self, host, port):
+        if (leases := self._leases.get(host)) is not None:
+            leases.discard(port)
+            if not leases:
+                del self._leases[host]
+
+    def count(self, host):
+        """Return the number of ports currently leased on `host`."""
+        return len(self._leases.get(host, ()))
+
+
+class SSHHostProber(LoggingConfigurable):
+    """Periodically collects load information from a pool of remote hosts.
+
+    All hosts are probed in parallel by a background task, started as soon as
+    the pool is known, and placement decisions only read the cached results.
+    Spawns only wait for the first probe of a pool, for at most `timeout`
+    seconds. Hosts that fail or time out their last probe are considered
+    unhealthy until the next successful one.
+
+    Probes run as a dedicated remote account, configured with `username` and
+    `keyfile`, so that they never depend on the credentials of a single user.
+    Without a `username`, hosts are not probed and placements only consider
+    the number of notebooks running on each host."""
+
+    interval = Float(
+        30, config=True, help="Seconds between two consecutive probes of the hosts"
+    )
+
+    timeout = Float(10, config=True, help="Timeout in seconds for a single probe")
+
+    username = Unicode(
+        "", config=True, help="Remote user that runs the probes on the remote hosts"
+    )
+
+    keyfile = Unicode(
+        "~/.ssh/id_rsa",
+        config=True,
+        help=dedent(
+            """Key file used to authenticate the probes with the remote hosts.
+
+            The certificate is expected in the `-cert.pub` file next to the key."""
+        ),
+    )
+
+    runner = Any(
+        help=dedent(
+            """Coroutine function used to run the probe command on a remote host.
+
+            It is called with the command and the `host`, `username` and `keyfile`
+            keyword arguments."""
+        )
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.hosts: set[str] = set()
+        self.stats: dict[str, dict] = {}
+        self._probed = asyncio.Event()
+        self._task = None
+
+    async def _probe(self, host):
+        try:
+            result = await asyncio.wait_for(
+                self.runner(
+                    "echo $(nproc) $(cut -d ' ' -f 1 /proc/loadavg) "
+                    "$(awk '/^MemAvailable:/ {print $2}' /proc/meminfo)",
+                    host=host,
+                    username=self.username,
+                    keyfile=self.keyfile,
+                ),
+                self.timeout,
+            )
+            cpus, load, mem_available = result.stdout.split()
+            self.stats[host] = {
+                "healthy": True,
+                "load": float(load) / max(int(cpus), 1),
+                "mem_available": int(mem_available) * 1024,
+                "updated": time.monotonic(),
+            }
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.log.warning(f"Failed to probe remote host {host}: {e!r}")
+            self.stats[host] = {"healthy": False, "updated": time.monotonic()}
+
+    async def _probe_loop(self):
+        while True:
+            self._probed.clear()
+            await asyncio.gather(*(self._probe(h) for h in list(self.hosts)))
+            self._probed.set()
+            await asyncio.sleep(self.interval)
+
+    def start(self, hosts):
+        """Include `hosts` in the probes, starting the background task if needed."""
+        new_hosts = set(hosts) - self.hosts
+        self.hosts.update(hosts)
+        if not self.username:
+            if new_hosts:
+                self.log.warning(
+                    "SSHHostProber.username is not set, remote hosts are placed "
+                    "by number of notebooks only"
+                )
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._probe_loop())
+        elif new_hosts:
+            # Probe new hosts right away instead of waiting for the next round
+            for host in new_hosts:
+                asyncio.ensure_future(self._probe(host))
+
+    async def stop(self):
+        """Stop the background task."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def select(self, hosts, notebooks):
+        """Return the least loaded healthy host among `hosts`.
+
+        Hosts are ranked by load average per CPU, then by number of running
+        notebooks (as returned by the `notebooks` function), then by available
+        memory. Hosts without recent probe data are ranked by notebooks only."""
+        self.start(hosts)
+        if self.username and not any(h in self.stats for h in hosts):
+            try:
+                await asyncio.wait_for(self._probed.wait(), self.timeout)
+            except asyncio.TimeoutError:
+                pass
+        deadline = time.monotonic() - 3 * self.interval
+        fresh = {
+            h: self.stats[h]
+            for h in hosts
+            if h in self.stats and self.stats[h]["updated"] >= deadline
+        }
+        if healthy := [h for h in hosts if fresh.get(h, {}).get("healthy")]:
+            return min(
+                healthy,
+                key=lambda h: (
+                    round(fresh[h]["load"], 1),
+                    notebooks(h),
+                    -fresh[h]["mem_available"],
+                ),
+            )
+        # No usable probe data yet: avoid hosts known to be unhealthy
+        candidates = [h for h in hosts if h not in fresh] or list(hosts)
+        return min(candidates, key=notebooks)
 
 
 class SSHSpawner(Spawner):
+    connection_pool: SSHConnectionPool | None = None
+    credential_cache = SSHCredentialCache()
+    port_allocator: SSHPortAllocator | None = None
+    host_prober: SSHHostProber | None = None
+    host_pollers: dict[tuple, SSHHostPoller] = {}
+    host_stoppers: dict[tuple, SSHHostStopper] = {}
+
     remote_host = Unicode(help="SSH remote host to spawn sessions on", config=True)
 
+    remote_hosts = List(
+        Unicode(),
+        help=dedent(
+            """Pool of SSH remote hosts to spawn sessions on.
+
+            If set, each session is placed on the least loaded healthy host of
+            the pool, according to periodic background probes, and `remote_host`
+            is ignored. Probes run as `SSHHostProber.username`."""
+        ),
+        config=True,
+    )
+
     remote_port = Unicode("22", help="SSH remote port number", config=True)
 
     ssh_command = Unicode("/usr/bin/ssh", help="Actual SSH command", config=True)
@@ -59,6 +764,17 @@ class SSHSpawner(Spawner):
         config=True,
     )
 
+    credential_id = Unicode(
+        None,
+        allow_none=True,
+        help=dedent(
+            """Key file used to authenticate the restored session with the remote
+            host, as persisted in the spawner state.
+
+            It takes precedence over `ssh_keyfile` until the state is cleared."""
+        ),
+    )
+
     pid = Integer(
         0,
         help=dedent(
@@ -77,6 +793,17 @@ class SSHSpawner(Spawner):
         config=True,
     )
 
+    cache_launch_script = Bool(
+        True,
+        help=dedent(
+            """Whether to cache the static parts of the launch script.
+
+            When enabled, the script is built once for each distinct command and
+            only the environment is filled in at every spawn."""
+        ),
+        config=True,
+    )
+
     # Options to specify whether the Spawner should enable the client to
     # create a backward ssh tunnnel to the JupyterHub instance
     ssh_backtunnel_client = Bool(default=False, config=True)
@@ -91,97 +818,164 @@ class SSHSpawner(Spawner):
         "copied to the Notebook during the spawn",
     )
 
-    async def _transfer(self, username, key, certificate, local_resource_path, dst):
-        # create resource path dir in user's home on remote
-        async with asyncssh.connect(
-            self.remote_host,
-            username=username,
-            client_keys=[(key, certificate)],
-            known_hosts=None,
-        ) as conn:
-            mkdir_cmd = f"mkdir -p {dst} 2>/dev/null"
-            _ = await conn.run(mkdir_cmd)
-
-        # copy files
-        files = [
-            os.path.join(local_resource_path, f)
-            for f in os.listdir(local_resource_path)
-        ]
-        async with asyncssh.connect(
-            self.remote_host,
-            username=username,
-            client_keys=[(key, certificate)],
-            known_hosts=None,
-        ) as conn:
-            await asyncssh.scp(files, (conn, dst))
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._start_host_prober()
+
+    def _credential_id(self, username):
+        if self.credential_id:
+            return self.credential_id
+        return os.path.expanduser(self.ssh_keyfile.format(username=username))
+
+    async def _client_keys(self, username):
+        kf = self._credential_id(username)
+        return kf, await self.credential_cache.get(kf)
+
+    def _get_connection_pool(self):
+        # The pool is a singleton shared among all SSHSpawner instances
+        if SSHSpawner.connection_pool is None:
+            SSHSpawner.connection_pool = SSHConnectionPool(parent=self)
+        return SSHSpawner.connection_pool
+
+    def _get_port_allocator(self):
+        if SSHSpawner.port_allocator is None:
+            SSHSpawner.port_allocator = SSHPortAllocator(parent=self)
+        return SSHSpawner.port_allocator
+
+    def _remote_account(self):
+        # Batched operations only group processes owned by the same remote login
+        username = self.get_remote_user(self.user.name)
+        return self.remote_host, username, self._credential_id(username)
+
+    def _get_host_poller(self):
+        key = self._remote_account()
+        if key not in SSHSpawner.host_pollers:
+            SSHSpawner.host_pollers[key] = SSHHostPoller(
+                parent=self, host=self.remote_host, username=key[1]
+            )
+        return SSHSpawner.host_pollers[key]
+
+    def _get_host_stopper(self):
+        key = self._remote_account()
+        if key not in SSHSpawner.host_stoppers:
+            SSHSpawner.host_stoppers[key] = SSHHostStopper(
+                parent=self, host=self.remote_host, username=key[1]
+            )
+        return SSHSpawner.host_stoppers[key]
+
+    async def _run(self, command, host=None, **kwargs):
+        username = self.get_remote_user(self.user.name)
+        kf, client_keys = await self._client_keys(username)
+        return await self._get_connection_pool().run(
+            host or self.remote_host, username, client_keys, kf, command, **kwargs
+        )
+
+    def _get_host_prober(self):
+        if SSHSpawner.host_prober is None:
+            SSHSpawner.host_prober = SSHHostProber(
+                parent=self, runner=self._run_as_prober
+            )
+        return SSHSpawner.host_prober
+
+    async def _run_as_prober(self, command, host, username, keyfile):
+        # Probes do not depend on the spawner, only on the pool and the cache
+        kf = os.path.expanduser(keyfile)
+        client_keys = await SSHSpawner.credential_cache.get(kf)
+        return await self._get_connection_pool().run(
+            host, username, client_keys, kf, command
+        )
+
+    def _start_host_prober(self):
+        # Probe the pool from hub startup on, so that early spawns have load data
+        if self.remote_hosts:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return
+            self._get_host_prober().start(self.remote_hosts)
+
+    async def _select_remote_host(self):
+        return await self._get_host_prober().select(
+            self.remote_hosts, self._get_port_allocator().count
+        )
+
+    @classmethod
+    async def close_shared(cls):
+        """Stop the background tasks shared by all `SSHSpawner` instances, and
+        close their pooled connections."""
+        if SSHSpawner.host_prober is not None:
+            await SSHSpawner.host_prober.stop()
+        if SSHSpawner.connection_pool is not None:
+            await SSHSpawner.connection_pool.close()
 
     def load_state(self, state):
         """Restore state about ssh-spawned server after a hub restart.
 
-        The ssh-spawned processes need IP and the process id."""
+        The ssh-spawned processes need IP, port, credential and the process id.
+        Restored processes are registered with the poller of their host, so that
+        the polls issued by the hub at startup revalidate all the servers of a
+        host with a single batched check."""
         super().load_state(state)
-        if "pid" in state:
+        if state.get("pid", 0) > 0:
             self.pid = state["pid"]
         if "remote_host" in state:
             self.remote_host = state["remote_host"]
+        if "ssh_keyfile" in state:
+            self.credential_id = state["ssh_keyfile"]
+        if "port" in state:
+            self.port = state["port"]
+            self.remote_port = str(self.port)
+            self._get_port_allocator().restore(self.remote_host, self.port)
+        if self.pid and self.remote_host:
+            self._get_host_poller().register(self.pid, self._run)
+        self._start_host_prober()
 
     def get_state(self):
         """Save state needed to restore this spawner instance after hub restore.
 
-        The ssh-spawned processes need IP and the process id."""
+        The ssh-spawned processes need IP, port, credential and the process id."""
         state = super().get_state()
-        if self.pid:
+        if self.pid > 0:
             state["pid"] = self.pid
+            state["remote_host"] = self.remote_host
+            state["ssh_keyfile"] = self._credential_id(
+                self.get_remote_user(self.user.name)
+            )
+        if self.port:
+            state["port"] = self.port
         return state
 
     def clear_state(self):
-        """Clear stored state about this spawner (ip, pid)"""
+        """Clear stored state about this spawner (ip, pid, port)"""
         super().clear_state()
+        if self.pid and (key := self._remote_account()) in SSHSpawner.host_pollers:
+            SSHSpawner.host_pollers[key].unregister(self.pid)
         self.pid = 0
+        self.credential_id = None
+        if self.port:
+            self._get_port_allocator().release(self.remote_host, self.port)
+            self.port = 0
 
     async def start(self):
-        """Start single-user server on remote host."""
-        username = self.user.name
-        kf = self.ssh_keyfile.format(username=username)
-        cf = kf + "-cert.pub"
-        k = asyncssh.read_private_key(kf)
-        c = asyncssh.read_certificate(cf)
-
-        self.remote_host, port = await self.remote_random_port()
-
-        if self.remote_host is None or port is None or port == 0:
-            return False
-        self.remote_port = str(port)
+        """Start single-user server on remote host.
 
+        Credentials staging, port selection and notebook launch all happen in a
+        single remote session."""
         cmd = []
         cmd.extend(self.cmd)
         cmd.extend(self.get_args())
 
+        files = {}
+        loop = asyncio.get_running_loop()
         if self.user.settings["internal_ssl"]:
-            with TemporaryDirectory() as td:
-                local_resource_path = td
-                self.cert_paths = self.stage_certs(self.cert_paths, local_resource_path)
-                await self._transfer(
-                    username=username,
-                    key=k,
-                    certificate=c,
-                    local_resource_path=local_resource_path,
-                    dst=self.resource_path,
-                )
+            self.cert_paths = await loop.run_in_executor(
+                None, self.stage_certs, self.cert_paths, files
+            )
 
         if self.ssh_backtunnel_client:
-            with TemporaryDirectory() as td:
-                local_resource_path = td
-                _ = self.stage_ssh_keys(
-                    self.ssh_forward_credentials_paths, local_resource_path
-                )
-                await self._transfer(
-                    username=username,
-                    key=k,
-                    certificate=c,
-                    local_resource_path=local_resource_path,
-                    dst=self.ssh_backtunnel_client_path,
-                )
+            _ = await loop.run_in_executor(
+                None, self.stage_ssh_keys, self.ssh_forward_credentials_paths, files
+            )
 
         if self.hub_api_url != "":
             old = f"--hub-api-url={self.hub.api_url}"
@@ -191,16 +985,32 @@ class SSHSpawner(Spawner):
                     cmd[index] = new
         for index, value in enumerate(cmd):
             if value[0:6] == "--port":
-                cmd[index] = "--port=%d" % (port)
+                cmd[index] = "--port=$port"
 
         remote_cmd = " ".join(cmd)
 
-        self.pid = await self.exec_notebook(remote_cmd)
-
-        self.log.debug(f"Starting User: {self.user.name}, PID: {self.pid}")
-
-        if self.pid < 0:
+        if self.remote_hosts:
+            self.remote_host = await self._select_remote_host()
+            self.log.debug(f"Placing {self._log_name} on {self.remote_host}")
+        allocator = self._get_port_allocator()
+        self.port = allocator.lease(self.remote_host)
+        port, pid = await self.exec_notebook(remote_cmd, files, self.port)
+        # A failed launch returns -1, which must never be signalled
+        self.pid = max(pid, 0)
+
+        self.log.debug(f"Starting User: {self.user.name}, PID: {pid}")
+
+        if port != self.port:
+            # The leased port was already bound on the remote host
+            allocator.release(self.remote_host, self.port)
+            self.port = port or 0
+            if self.port:
+                allocator.restore(self.remote_host, self.port)
+        if port is None or port == 0:
+            return False
+        if not self.pid:
             return None
+        self.remote_port = str(port)
 
         return self.remote_host, port
 
@@ -210,13 +1020,18 @@ class SSHSpawner(Spawner):
         If it is still running return None. If it is not running return exit
         code of the process if we have access to it, or 0 otherwise."""
 
-        if not self.pid:
+        if self.pid <= 0:
             # no pid, not running
             self.clear_state()
             return 0
 
-        # send signal 0 to check if PID exists
-        alive = await self.remote_signal(0)
+        # check the PID together with all the others running on the same host
+        poller = self._get_host_poller()
+        poller.register(self.pid, self._run)
+        alive = await poller.is_alive(self.pid)
+        if alive is None:
+            # send signal 0 to check if PID exists
+            alive = await self.remote_signal(0)
         self.log.debug(f"Polling returned {alive}")
 
         if not alive:
@@ -226,8 +1041,20 @@ class SSHSpawner(Spawner):
             return None
 
     async def stop(self, now=False):
-        """Stop single-user server process for the current user."""
-        _ = await self.remote_signal(15)
+        """Stop single-user server process for the current user.
+
+        Concurrent stops of servers on the same host are sent in a single batch."""
+        if self.pid > 0:
+            try:
+                result = await self._get_host_stopper().stop(self.pid, self._run)
+                self.log.debug(f"Process {self.pid} of {self._log_name} {result}")
+            except Exception:
+                self.log.exception(f"Batched stop failed on {self.remote_host}")
+                if not await self.remote_signal(15):
+                    self.log.error(
+                        f"Failed to stop process {self.pid} of {self._log_name} "
+                        f"on {self.remote_host}"
+                    )
         self.clear_state()
 
     def get_remote_user(self, username):
@@ -240,25 +1067,11 @@ class SSHSpawner(Spawner):
 
         If this fails for some reason return `None`."""
 
-        username = self.get_remote_user(self.user.name)
-        kf = self.ssh_keyfile.format(username=username)
-        cf = kf + "-cert.pub"
-        k = asyncssh.read_private_key(kf)
-        c = asyncssh.read_certificate(cf)
-        self.log.debug(
-            "Connecting to {}@{}:{} using key {} and certificate {}".format(
-                username, self.remote_host, self.remote_port, kf, cf
-            )
-        )
-
         # this needs to be done against remote_host, first time we're calling up
-        async with asyncssh.connect(
-            self.remote_host, username=username, client_keys=[(k, c)], known_hosts=None
-        ) as conn:
-            result = await conn.run(self.remote_port_command)
-            stdout = result.stdout
-            stderr = result.stderr
-            retcode = result.exit_status
+        result = await self._run(self.remote_port_command)
+        stdout = result.stdout
+        stderr = result.stderr
+        retcode = result.exit_status
 
         if stdout != b"":
             port = stdout
@@ -273,9 +1086,16 @@ class SSHSpawner(Spawner):
         ip = self.remote_host
         return ip, port
 
-    # FIXME add docstring
-    async def exec_notebook(self, command):
-        """TBD"""
+    async def exec_notebook(self, command, files=None, port=None):
+        """Launch the single-user server on the remote host in a single session.
+
+        The launch script writes the staged `files` (a dictionary of remote paths
+        to contents), and runs `command`, which can refer to the selected port as
+        `$port`. If `port` is not given or is already bound on the remote host,
+        an unoccupied port is selected with `remote_port_command`, and the
+        `JUPYTERHUB_SERVICE_URL` of the notebook is updated accordingly.
+
+        Return a `(port, pid)` tuple, where `pid` is -1 if the launch failed."""
 
         env = super().get_env()
         env["JUPYTERHUB_API_URL"] = self.hub_api_url
@@ -286,67 +1106,55 @@ class SSHSpawner(Spawner):
             "activity",
         )
         env["PATH"] = self.path
-        username = self.get_remote_user(self.user.name)
-        kf = self.ssh_keyfile.format(username=username)
-        cf = kf + "-cert.pub"
-        k = asyncssh.read_private_key(kf)
-        c = asyncssh.read_certificate(cf)
-        bash_script_str = "#!/bin/bash\n"
-
-        for item in env.items():
-            # item is a (key, value) tuple
-            # command = ('export %s=%s;' % item) + command
-            bash_script_str += "export %s=%s\n" % item
-        bash_script_str += "unset XDG_RUNTIME_DIR\n"
-
-        bash_script_str += "touch .jupyter.log\n"
-        bash_script_str += "chmod 600 .jupyter.log\n"
-        bash_script_str += "%s < /dev/null >> .jupyter.log 2>&1 & pid=$!\n" % command
-        bash_script_str += "echo $pid\n"
-
-        run_script = f"/tmp/{self.user.name}_run.sh"
-        with open(run_script, "w") as f:
-            f.write(bash_script_str)
-        if not os.path.isfile(run_script):
-            raise Exception("The file " + run_script + "was not created.")
+        if self.cache_launch_script:
+            prologue, epilogue = _launch_script_template(
+                self.remote_port_command, command
+            )
         else:
-            with open(run_script) as f:
-                self.log.debug(run_script + " was written as:\n" + f.read())
+            prologue, epilogue = _launch_script_template.__wrapped__(
+                self.remote_port_command, command
+            )
+        bash_script_str = f"port={port or ''}\n" + prologue
+        for key, value in env.items():
+            if key == "JUPYTERHUB_SERVICE_URL":
+                bash_script_str += _service_url_export(value)
+            else:
+                bash_script_str += f"export {key}={_shell_value(value)}\n"
+        bash_script_str += epilogue
 
-        async with asyncssh.connect(
-            self.remote_host, username=username, client_keys=[(k, c)], known_hosts=None
-        ) as conn:
-            result = await conn.run("bash -s", stdin=run_script)
-            stdout = result.stdout
-            _ = result.stderr
-            retcode = result.exit_status
+        self.log.debug(
+            f"Launch script for {self.user.name} staging {len(files or {})} "
+            f"files:\n{bash_script_str}"
+        )
+        # Staged files may contain credentials, so they are never logged
+        result = await self._run(
+            "bash -s",
+            input="#!/bin/bash\n" + _stage_files_script(files or {}) + bash_script_str,
+        )
+        stdout = result.stdout
+        stderr = result.stderr
+        retcode = result.exit_status
 
         self.log.debug(f"exec_notebook status={retcode}")
-        if stdout != b"":
-            pid = int(stdout)
+        if stdout:
+            port, pid = stdout.split()[-2:]
+            return int(port), int(pid)
         else:
-            return -1
-
-        return pid
+            self.log.error("Failed to launch the single-user server")
+            self.log.error(f"STDERR={stderr}")
+            return None, -1
 
     async def remote_signal(self, sig):
         """Signal on the remote host."""
-
-        username = self.get_remote_user(self.user.name)
-        kf = self.ssh_keyfile.format(username=username)
-        cf = kf + "-cert.pub"
-        k = asyncssh.read_private_key(kf)
-        c = asyncssh.read_certificate(cf)
+        if self.pid <= 0:
+            return False
 
         command = "kill -s %s %d < /dev/null" % (sig, self.pid)
 
-        async with asyncssh.connect(
-            self.remote_host, username=username, client_keys=[(k, c)], known_hosts=None
-        ) as conn:
-            result = await conn.run(command)
-            stdout = result.stdout
-            stderr = result.stderr
-            retcode = result.exit_status
+        result = await self._run(command)
+        stdout = result.stdout
+        stderr = result.stderr
+        retcode = result.exit_status
         self.log.debug(
             "command: {} returned {} --- {} --- {}".format(
                 command, stdout, stderr, retcode
@@ -354,35 +1162,41 @@ class SSHSpawner(Spawner):
         )
         return retcode == 0
 
-    def stage_ssh_keys(self, paths, dest):
-        shutil.copy(paths["private_key_file"], dest)
-        shutil.copy(paths["public_key_file"], dest)
-
-        private_key_file = os.path.basename(paths["private_key_file"])
-        public_key_file = os.path.basename(paths["public_key_file"])
+    def stage_ssh_keys(self, paths, files):
+        """Read the back-tunnel SSH keys into the `files` dictionary.
 
+        Keys are stored under their remote paths, and are written on the remote
+        host by the launch script."""
         private_key_path = os.path.join(
-            self.ssh_backtunnel_client_path, private_key_file
+            self.ssh_backtunnel_client_path,
+            os.path.basename(paths["private_key_file"]),
+        )
+        public_key_path = os.path.join(
+            self.ssh_backtunnel_client_path,
+            os.path.basename(paths["public_key_file"]),
         )
-        public_key_path = os.path.join(self.ssh_backtunnel_client_path, public_key_file)
+        files[private_key_path] = _read_file(paths["private_key_file"])
+        files[public_key_path] = _read_file(paths["public_key_file"])
 
         return {
             "private_key_path": private_key_path,
             "public_key_path": public_key_path,
         }
 
-    def stage_certs(self, paths, dest):
-        shutil.move(paths["keyfile"], dest)
-        shutil.move(paths["certfile"], dest)
-        shutil.copy(paths["cafile"], dest)
+    def stage_certs(self, paths, files):
+        """Read the internal SSL certificates into the `files` dictionary.
 
-        key_base_name = os.path.basename(paths["keyfile"])
-        cert_base_name = os.path.basename(paths["certfile"])
-        ca_base_name = os.path.basename(paths["cafile"])
+        Key and certificate are removed from the hub, as they are only needed on
+        the remote host. Return the remote paths of the certificates."""
+        key = os.path.join(self.resource_path, os.path.basename(paths["keyfile"]))
+        cert = os.path.join(self.resource_path, os.path.basename(paths["certfile"]))
+        ca = os.path.join(self.resource_path, os.path.basename(paths["cafile"]))
 
-        key = os.path.join(self.resource_path, key_base_name)
-        cert = os.path.join(self.resource_path, cert_base_name)
-        ca = os.path.join(self.resource_path, ca_base_name)
+        files[key] = _read_file(paths["keyfile"])
+        files[cert] = _read_file(paths["certfile"])
+        files[ca] = _read_file(paths["cafile"])
+        os.remove(paths["keyfile"])
+        os.remove(paths["certfile"])
 
         return {
             "keyfile": key,
@@ -0,0 +1,73 @@
+"""Import timing, enabled by the `Dossier.import_timing` option or the
+`--import-timing` flag of the `dossier` command.
+
+While installed, the `ImportTimer` wraps the loader of each imported module and
+records how long the module took to execute, including the modules it imported
+in turn, like `python -X importtime` does.
+"""
+
+from __future__ import annotations
+
+import sys
+import time
+from importlib.abc import MetaPathFinder
+
+
+class _TimedLoader:
+    def __init__(self, timer, loader):
+        self.timer = timer
+        self.loader = loader
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        # Restore the original loader, so that the module looks as usual
+        module.__loader__ = module.__spec__.loader = self.loader
+        if self.timer._depth == 0:
+            self.timer.roots.append(module.__name__)
+        self.timer._depth += 1
+        start = time.perf_counter()
+        try:
+            self.loader.exec_module(module)
+        finally:
+            self.timer.times[module.__name__] = time.perf_counter() - start
+            self.timer._depth -= 1
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+
+class ImportTimer(MetaPathFinder):
+    def __init__(self):
+        # Module names to their cumulative import times, in seconds
+        self.times = {}
+        # Modules whose import was not triggered by another timed import
+        self.roots = []
+        self._depth = 0
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            if (spec := finder.find_spec(fullname, path, target)) is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(self, spec.loader)
+                return spec
+        return None
+
+    def install(self):
+        sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def report(self, limit=20):
+        """Return the lines of a report on the `limit` slowest root imports."""
+        roots = sorted(self.roots, key=self.times.get, reverse=True)
+        total = sum(self.times[name] for name in roots)
+        lines = [f"Imports took {total:.3f} seconds", "cumulative [ms] | module"]
+        for name in roots[:limit]:
+            lines.append(f"{self.times[name] * 1000:15.1f} | {name}")
+        return lines
@@ -1,41 +1,421 @@
+from __future__ import annotations
+
+import asyncio
+import copy
+import importlib
+import re
+from contextvars import ContextVar
+from typing import Any, MutableMapping
+
+from jupyterhub.spawner import Spawner
 from kubernetes_asyncio.client import ApiException
+from tornado.log import app_log
 
+from dossier.cache import ObjectCache, _is_transient
+from dossier.metrics import KUBERNETES_COALESCED_REQUESTS
+from dossier.reflector import CustomObjectReflector
 
-async def get_spawner(api, name):
-    try:
-        return await api.get_cluster_custom_object(
-            group="dossier.unito.it", version="v1alpha1", plural="spawners", name=name
+# Spawners that do not restrict their `spec.tenants` are enabled on every tenant
+ALL_TENANTS = "*"
+
+# Number of objects requested per page when listing objects from the API server
+LIST_PAGE_SIZE = 500
+
+# Users with at most this number of groups look up their tenants by name through
+# field selectors, instead of scanning the metadata of all tenants
+FIELD_SELECTOR_MAX_GROUPS = 8
+
+# Object names are DNS-1123 subdomains, so groups with other names match no tenant
+_DNS1123_SUBDOMAIN = re.compile(
+    r"[a-z0-9]([-a-z0-9]*[a-z0-9])?(\.[a-z0-9]([-a-z0-9]*[a-z0-9])?)*"
+)
+
+_PARTIAL_OBJECT_METADATA_LIST = (
+    "application/json;as=PartialObjectMetadataList;g=meta.k8s.io;v=v1,application/json"
+)
+
+# Constructor arguments of Spawner CR classes, copied from the user's spawner
+# unless overridden by the CR `spec.parameters`, with the related attribute name
+_SPAWNER_DEFAULT_ARGS = {
+    "cmd": "cmd",
+    "args": "args",
+    "env": "env",
+    "user": "user",
+    "db": "db",
+    "hub": "hub",
+    "authenticator": "authenticator",
+    "oauth_client_id": "oauth_client_id",
+    "orm_spawner": "orm_spawner",
+    "proxy_spec": "proxy_spec",
+    "server": "_server",
+    "config": "config",
+}
+
+_reflectors: MutableMapping[str, CustomObjectReflector] = {}
+_spawner_classes: MutableMapping[str, tuple[str | None, SpawnerClass | Exception]] = {}
+_inflight: MutableMapping[tuple, asyncio.Future] = {}
+_request_results: ContextVar[MutableMapping[tuple, asyncio.Future] | None] = ContextVar(
+    "dossier_request_results", default=None
+)
+_cache = ObjectCache()
+
+
+def _spawner_tenants(spawner):
+    return spawner.get("spec", {}).get("tenants") or [ALL_TENANTS]
+
+
+def is_spawner_enabled(spawner, tenant):
+    tenants = _spawner_tenants(spawner)
+    return ALL_TENANTS in tenants or tenant in tenants
+
+
+def _tenant_groups(tenant):
+    # Users can spawn on a tenant when they belong to the group with the same name
+    return [tenant["metadata"]["name"]]
+
+
+async def _coalesce(key, coro_fn):
+    # Concurrent identical reads share the same in-flight request
+    if (future := _inflight.get(key)) is not None:
+        KUBERNETES_COALESCED_REQUESTS.labels(plural=key[1], verb=key[0]).inc()
+    else:
+        future = _inflight[key] = asyncio.ensure_future(coro_fn())
+        future.add_done_callback(lambda _: _inflight.pop(key, None))
+    return await asyncio.shield(future)
+
+
+async def _fetch(key, coro_fn):
+    # Within a request scope, each distinct read is performed at most once
+    if (results := _request_results.get()) is None:
+        return await _coalesce(key, coro_fn)
+    if (future := results.get(key)) is None:
+        future = results[key] = asyncio.ensure_future(_coalesce(key, coro_fn))
+    return await asyncio.shield(future)
+
+
+def start_request_scope():
+    """Memoize the results of API calls until the end of the current request.
+
+    Tornado serves each request in its own task, so results never leak to
+    other requests."""
+    _request_results.set({})
+
+
+def prefetch(coro):
+    """Start a lookup in the background, so that the same lookups performed later
+    in the current request scope reuse its results.
+
+    Errors are only raised to those later lookups. Outside a request scope the
+    results could not be reused, and the lookup is not started at all."""
+    if _request_results.get() is None:
+        coro.close()
+        return
+    task = asyncio.ensure_future(coro)
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+
+async def _get_object(api, group, version, plural, name) -> Any:
+    async def get():
+        try:
+            return await api.get_cluster_custom_object(
+                group=group, version=version, plural=plural, name=name
+            )
+        except ApiException as error:
+            if error.status == 404:
+                return None
+            else:
+                raise error
+
+    key = ("get", plural, name)
+    return await _fetch(key, lambda: _cache.get(key, get))
+
+
+def _metadata_api(api):
+    """Return a copy of `api` whose requests ask for `PartialObjectMetadataList`
+    responses, sharing the connection pool of `api`.
+
+    The generated methods overwrite any Accept header passed through `_headers`,
+    while the default headers of the client take precedence over it."""
+    api_client = copy.copy(api.api_client)
+    api_client.default_headers = {
+        **api.api_client.default_headers,
+        "Accept": _PARTIAL_OBJECT_METADATA_LIST,
+    }
+    api = copy.copy(api)
+    api.api_client = api_client
+    return api
+
+
+async def _iter_objects(
+    api,
+    group,
+    version,
+    plural,
+    label_selector=None,
+    field_selector=None,
+    metadata_only=False,
+):
+    """Yield the listed objects one page at a time, so that only `LIST_PAGE_SIZE`
+    objects are decoded and held in memory at once.
+
+    When `metadata_only` is set, the API server returns `PartialObjectMetadata`
+    objects, stripped of everything but their `metadata` field."""
+    kwargs = {"limit": LIST_PAGE_SIZE}
+    if label_selector:
+        kwargs["label_selector"] = label_selector
+    if field_selector:
+        kwargs["field_selector"] = field_selector
+    if metadata_only:
+        api = _metadata_api(api)
+    _continue = None
+    while True:
+        page = await api.list_cluster_custom_object(
+            group=group,
+            version=version,
+            plural=plural,
+            _continue=_continue,
+            **kwargs,
         )
-    except ApiException as error:
-        if error.status == 404:
-            return None
-        else:
-            raise error
+        for obj in page["items"]:
+            yield obj
+        if not (_continue := page["metadata"].get("continue")):
+            break
+
+
+async def _list_objects(api, group, version, plural, **kwargs) -> Any:
+    async def list_():
+        return [o async for o in _iter_objects(api, group, version, plural, **kwargs)]
 
+    key = ("list", plural, *sorted(kwargs.items()))
+    return await _fetch(key, lambda: _cache.get(key, list_))
 
-async def get_spawners(api):
-    return (
-        await api.list_cluster_custom_object(
-            group="dossier.unito.it", version="v1alpha1", plural="spawners"
+
+class SpawnerClass:
+    """The validated class of a Spawner CR, with its constructor arguments."""
+
+    def __init__(self, spawner):
+        module_name, _, class_simplename = spawner["spec"]["class"].rpartition(".")
+        self.class_ = getattr(importlib.import_module(module_name), class_simplename)
+        if not (isinstance(self.class_, type) and issubclass(self.class_, Spawner)):
+            raise TypeError(
+                f"{spawner['spec']['class']} is not a subclass of {Spawner.__module__}.Spawner"
+            )
+        self.parameters = dict(spawner["spec"].get("parameters") or {})
+        self.default_args = tuple(
+            (arg, attr)
+            for arg, attr in _SPAWNER_DEFAULT_ARGS.items()
+            if arg not in self.parameters
         )
-    )["items"]
 
+    def create(self, spawner):
+        """Instantiate the class, inheriting the settings of the given spawner."""
+        kwargs = {arg: getattr(spawner, attr) for arg, attr in self.default_args}
+        kwargs.update(self.parameters)
+        return self.class_(**kwargs)
 
-async def get_tenant(api, name):
+
+def _register_spawner_class(spawner):
+    name = spawner["metadata"]["name"]
     try:
-        return await api.get_cluster_custom_object(
-            group="capsule.clastix.io", version="v1beta2", plural="tenants", name=name
-        )
-    except ApiException as error:
-        if error.status == 404:
-            return None
-        else:
-            raise error
+        result = SpawnerClass(spawner)
+    except Exception as e:
+        app_log.error(f"Spawner {name} has an invalid class: {e!r}")
+        result = e
+    _spawner_classes[name] = (spawner["metadata"].get("resourceVersion"), result)
+    return result
+
+
+def _unregister_spawner_class(spawner):
+    _spawner_classes.pop(spawner["metadata"]["name"], None)
+
+
+def get_spawner_class(spawner):
+    """Return the `SpawnerClass` of a Spawner CR.
+
+    Classes are resolved when the CR is first seen or changes. If the class
+    cannot be imported or is not a JupyterHub `Spawner`, the related error is
+    raised."""
+    entry = _spawner_classes.get(spawner["metadata"]["name"])
+    if entry is None or entry[0] != spawner["metadata"].get("resourceVersion"):
+        result = _register_spawner_class(spawner)
+    else:
+        result = entry[1]
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def _get_reflector(plural):
+    if (reflector := _reflectors.get(plural)) is not None and reflector.synced:
+        return reflector
+    return None
+
+
+def init_cache(parent=None):
+    """Configure the cache that serves direct API calls when reflectors are not
+    synced, e.g., with `c.ObjectCache.max_staleness`."""
+    global _cache
+    _cache = ObjectCache(parent=parent)
+
+
+async def close_cache():
+    await _cache.close()
+
+
+def get_collection_version(plural):
+    """Return the version and the last modification time of a reflected collection.
+
+    Both change whenever an object of the collection is added, modified or
+    deleted. If the collection is not reflected, return `None`."""
+    if reflector := _get_reflector(plural):
+        return reflector.collection_version, reflector.last_modified
+    return None
 
 
-async def get_tenants(api):
-    return (
-        await api.list_cluster_custom_object(
-            group="capsule.clastix.io", version="v1beta2", plural="tenants"
+async def start_reflectors(api, parent=None):
+    """Start watching Dossier custom objects on the cluster.
+
+    Once a reflector is synced, the related `get_*` functions serve their results
+    from the local store instead of querying the API server. If a collection
+    cannot be listed, e.g., because the API server is unreachable, it is served
+    through direct API calls while the list is retried in the background."""
+    for group, version, plural, kwargs in (
+        (
+            "capsule.clastix.io",
+            "v1beta2",
+            "tenants",
+            {"indexers": {"groups": _tenant_groups}},
+        ),
+        (
+            "dossier.unito.it",
+            "v1alpha1",
+            "spawners",
+            {
+                "indexers": {"tenants": _spawner_tenants},
+                # Spawner classes are resolved as soon as CRs are added or changed
+                "on_update": _register_spawner_class,
+                "on_delete": _unregister_spawner_class,
+            },
+        ),
+    ):
+        reflector = CustomObjectReflector(
+            api=api,
+            group=group,
+            version=version,
+            plural=plural,
+            parent=parent,
+            **kwargs,
         )
-    )["items"]
+        try:
+            await reflector.start()
+        except Exception as error:
+            # An unreachable API server must not prevent the hub from starting
+            if not (isinstance(error, ApiException) or _is_transient(error)):
+                raise
+            reflector.log.warning(
+                f"Cannot watch {plural}.{group}, falling back to direct API calls "
+                "until a list succeeds: "
+                + (
+                    f"{error.status} {error.reason}"
+                    if isinstance(error, ApiException)
+                    else repr(error)
+                )
+            )
+            await reflector.start(wait=False)
+        _reflectors[plural] = reflector
+
+
+async def stop_reflectors():
+    for plural in list(_reflectors):
+        await _reflectors.pop(plural).stop()
+
+
+async def get_spawner(api, name):
+    if reflector := _get_reflector("spawners"):
+        return reflector.resources.get(name)
+    return await _get_object(api, "dossier.unito.it", "v1alpha1", "spawners", name)
+
+
+async def get_spawners(api, tenant=None):
+    """Return the Dossier spawners defined on the cluster.
+
+    If a `tenant` name is passed, only the spawners enabled on that tenant are
+    returned, i.e., the ones listing it in their `spec.tenants` field and the ones
+    that do not restrict their tenants at all."""
+    if reflector := _get_reflector("spawners"):
+        if tenant is None:
+            return list(reflector.resources.values())
+        return reflector.by_index("tenants", ALL_TENANTS) + [
+            s
+            for s in reflector.by_index("tenants", tenant)
+            if ALL_TENANTS not in _spawner_tenants(s)
+        ]
+    spawners = await _list_objects(api, "dossier.unito.it", "v1alpha1", "spawners")
+    if tenant is None:
+        return spawners
+    return [s for s in spawners if is_spawner_enabled(s, tenant)]
+
+
+async def get_tenant(api, name):
+    if reflector := _get_reflector("tenants"):
+        return reflector.resources.get(name)
+    return await _get_object(api, "capsule.clastix.io", "v1beta2", "tenants", name)
+
+
+async def get_tenants(api, metadata_only=False):
+    """Return the tenants defined on the cluster.
+
+    If `metadata_only` is set and the tenants are not reflected, the returned
+    objects only contain their `metadata` field."""
+    if reflector := _get_reflector("tenants"):
+        return list(reflector.resources.values())
+    return await _list_objects(
+        api, "capsule.clastix.io", "v1beta2", "tenants", metadata_only=metadata_only
+    )
+
+
+async def get_user_tenants(api, groups, metadata_only=False):
+    """Return a dictionary of the tenants that the given groups can use, by name.
+
+    When tenants are reflected, this costs one index lookup per group,
+    regardless of the number of tenants defined on the cluster. Otherwise, only
+    the relevant tenants are fetched from the API server. If `metadata_only` is
+    set, the returned objects may only contain their `metadata` field."""
+    if reflector := _get_reflector("tenants"):
+        return {
+            t["metadata"]["name"]: t
+            for g in groups
+            for t in reflector.by_index("groups", g)
+        }
+    groups = {g for g in groups if len(g) <= 253 and _DNS1123_SUBDOMAIN.fullmatch(g)}
+    if len(groups) <= FIELD_SELECTOR_MAX_GROUPS:
+        # Tenant names match group names, so the API server can filter them
+        tenants = [
+            t
+            for ts in await asyncio.gather(
+                *(
+                    _list_objects(
+                        api,
+                        "capsule.clastix.io",
+                        "v1beta2",
+                        "tenants",
+                        field_selector=f"metadata.name={g}",
+                        metadata_only=metadata_only,
+                    )
+                    for g in groups
+                )
+            )
+            for t in ts
+        ]
+    else:
+        # The metadata of all tenants is shared by all users, and cached as a whole
+        tenants = [
+            t
+            for t in await get_tenants(api, metadata_only=True)
+            if not groups.isdisjoint(_tenant_groups(t))
+        ]
+        if not metadata_only:
+            tenants = await asyncio.gather(
+                *(get_tenant(api, t["metadata"]["name"]) for t in tenants)
+            )
+    return {t["metadata"]["name"]: t for t in tenants if t is not None}
@@ -0,0 +1,39 @@
+"""Micro-benchmark of the Kubernetes quantity parser.
+
+Run it with `python -m tests.benchmark_quantity` from the repository root. It
+parses the quantities of a typical LimitRange with and without the memo."""
+
+import timeit
+
+from dossier.spawners.kubernetes import _get_limit_amounts, _parse_quantity
+
+LIMIT = {
+    "default": {"cpu": "500m", "memory": "2Gi", "nvidia.com/gpu": "0"},
+    "defaultRequest": {"cpu": "250m", "memory": "1Gi", "nvidia.com/gpu": "0"},
+    "min": {"cpu": "100m", "memory": "256Mi", "nvidia.com/gpu": "0"},
+    "max": {"cpu": "4", "memory": "16Gi", "nvidia.com/gpu": "2"},
+}
+
+UNITS = {"cpu": "element", "memory": "byte", "nvidia.com/gpu": "element"}
+
+QUANTITIES = [q for item in LIMIT.values() for q in item.values()] + [
+    "1.5e3",
+    "1E",
+    "+.5Ki",
+    "-12.75M",
+]
+
+
+def main(number=20000):
+    parse = _parse_quantity.__wrapped__
+    for name, stmt in (
+        ("parse (no memo)", lambda: [parse(q) for q in QUANTITIES]),
+        ("parse (memo)", lambda: [_parse_quantity(q) for q in QUANTITIES]),
+        ("LimitRange item", lambda: _get_limit_amounts(LIMIT, UNITS)),
+    ):
+        best = min(timeit.repeat(stmt, number=number, repeat=5)) / number
+        print(f"{name:>16}: {best * 1e6:8.2f} us per call")
+
+
+if __name__ == "__main__":
+    main()
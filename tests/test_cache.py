@@ -0,0 +1,126 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from kubernetes_asyncio.client import ApiException
+
+from dossier import cache
+from dossier.cache import KubernetesUnavailableError, ObjectCache
+
+KEY = ("list", "tenants")
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Fetcher:
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        result = self.results.pop(0) if len(self.results) > 1 else self.results[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, "time", SimpleNamespace(monotonic=clock))
+    return clock
+
+
+@pytest.mark.asyncio
+async def test_fresh_results_are_served_from_cache(clock):
+    object_cache = ObjectCache(max_age=5)
+    fetch = Fetcher(["a"], ["b"])
+    assert await object_cache.get(KEY, fetch) == ["a"]
+    clock.now += 5
+    assert await object_cache.get(KEY, fetch) == ["a"]
+    assert fetch.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_stale_results_are_served_while_revalidating(clock):
+    object_cache = ObjectCache(max_age=5, max_staleness=60)
+    fetch = Fetcher(["a"], ["b"])
+    await object_cache.get(KEY, fetch)
+    clock.now += 10
+    assert await object_cache.get(KEY, fetch) == ["a"]
+    # Concurrent stale reads share the same background refresh
+    assert await object_cache.get(KEY, fetch) == ["a"]
+    await asyncio.gather(*object_cache.refreshing.values())
+    assert fetch.calls == 2
+    assert await object_cache.get(KEY, fetch) == ["b"]
+
+
+@pytest.mark.asyncio
+async def test_expired_results_are_fetched_again(clock):
+    object_cache = ObjectCache(max_age=5, max_staleness=60)
+    fetch = Fetcher(["a"], ["b"])
+    await object_cache.get(KEY, fetch)
+    clock.now += 61
+    assert await object_cache.get(KEY, fetch) == ["b"]
+    assert not object_cache.refreshing
+
+
+@pytest.mark.asyncio
+async def test_non_transient_errors_are_raised_as_is(clock):
+    object_cache = ObjectCache(failure_threshold=1)
+    with pytest.raises(ApiException):
+        await object_cache.get(KEY, Fetcher(ApiException(status=403)))
+    assert not object_cache.degraded
+
+
+@pytest.mark.asyncio
+async def test_circuit_opens_half_opens_and_closes(clock):
+    object_cache = ObjectCache(failure_threshold=2, reset_timeout=30)
+    fetch = Fetcher(ApiException(status=503))
+    for _ in range(2):
+        with pytest.raises(KubernetesUnavailableError):
+            await object_cache.get(KEY, fetch)
+    assert object_cache.degraded
+    assert fetch.calls == 2
+    # While the circuit is open, no request reaches the API server
+    with pytest.raises(KubernetesUnavailableError):
+        await object_cache.get(KEY, fetch)
+    assert fetch.calls == 2
+    # After the reset timeout, a single trial request goes through
+    clock.now += 30
+    with pytest.raises(KubernetesUnavailableError):
+        await object_cache.get(KEY, fetch)
+    with pytest.raises(KubernetesUnavailableError):
+        await object_cache.get(KEY, fetch)
+    assert fetch.calls == 3
+    assert object_cache.degraded
+    # A successful trial request closes the circuit
+    clock.now += 30
+    fetch.results = [["a"]]
+    assert await object_cache.get(KEY, fetch) == ["a"]
+    assert not object_cache.degraded
+    assert object_cache.failures == 0
+
+
+@pytest.mark.asyncio
+async def test_open_circuit_serves_cached_results(clock):
+    object_cache = ObjectCache(
+        max_age=5, max_staleness=300, failure_threshold=1, reset_timeout=30
+    )
+    await object_cache.get(KEY, Fetcher(["a"]))
+    failing = Fetcher(asyncio.TimeoutError())
+    with pytest.raises(KubernetesUnavailableError):
+        await object_cache.get(("get", "tenants", "t"), failing)
+    assert object_cache.degraded
+    clock.now += 10
+    assert await object_cache.get(KEY, failing) == ["a"]
+    # Stale results are not revalidated while the circuit is open
+    assert not object_cache.refreshing
+    assert failing.calls == 1
@@ -0,0 +1,128 @@
+import random
+from decimal import Decimal
+from fractions import Fraction
+
+import pytest
+
+from dossier.spawners.kubernetes import (
+    _get_resource_amount_in_bytes,
+    _get_resource_amount_in_elements,
+    _parse_quantity,
+)
+
+# Reference grammar of Kubernetes quantities:
+#   <quantity>        ::= <signedNumber><suffix>
+#   <suffix>          ::= <binarySI> | <decimalExponent> | <decimalSI>
+#   <binarySI>        ::= Ki | Mi | Gi | Ti | Pi | Ei
+#   <decimalSI>       ::= m | "" | k | M | G | T | P | E (and n, u)
+#   <decimalExponent> ::= "e" <signedNumber> | "E" <signedNumber>
+#   <number>          ::= <digits> | <digits>.<digits> | <digits>. | .<digits>
+BINARY_SI = {s: 1024**i for i, s in enumerate(["Ki", "Mi", "Gi", "Ti", "Pi", "Ei"], 1)}
+DECIMAL_SI = {
+    "n": -9,
+    "u": -6,
+    "m": -3,
+    "": 0,
+    "k": 3,
+    "M": 6,
+    "G": 9,
+    "T": 12,
+    "P": 15,
+    "E": 18,
+}
+
+
+def random_digits(rng):
+    return "".join(rng.choice("0123456789") for _ in range(rng.randint(1, 6)))
+
+
+def random_number(rng):
+    return rng.choice(
+        [
+            lambda: random_digits(rng),
+            lambda: f"{random_digits(rng)}.{random_digits(rng)}",
+            lambda: f"{random_digits(rng)}.",
+            lambda: f".{random_digits(rng)}",
+        ]
+    )()
+
+
+def random_quantity(rng):
+    """Return a random quantity of the reference grammar and its exact value."""
+    sign = rng.choice(["", "+", "-"])
+    number = random_number(rng)
+    value = Fraction(Decimal(sign + number))
+    kind = rng.choice(["binary", "decimal", "exponent"])
+    if kind == "binary":
+        suffix = rng.choice(list(BINARY_SI))
+        return sign + number + suffix, value * BINARY_SI[suffix]
+    elif kind == "decimal":
+        suffix = rng.choice(list(DECIMAL_SI))
+        return sign + number + suffix, value * Fraction(10) ** DECIMAL_SI[suffix]
+    else:
+        exponent = rng.randint(-12, 12)
+        exponent_sign = rng.choice(["", "+"]) if exponent >= 0 else ""
+        marker = rng.choice("eE")
+        return (
+            f"{sign}{number}{marker}{exponent_sign}{exponent}",
+            value * Fraction(10) ** exponent,
+        )
+
+
+def test_random_quantities_match_the_reference_grammar():
+    rng = random.Random(1234)
+    for _ in range(2000):
+        quantity, expected = random_quantity(rng)
+        assert _parse_quantity(quantity) == expected, quantity
+
+
+@pytest.mark.parametrize(
+    "quantity,expected",
+    [
+        ("1Ki", 1024),
+        ("1.5Gi", 3 * 2**29),
+        ("100m", Fraction(1, 10)),
+        ("250u", Fraction(1, 4000)),
+        ("5n", Fraction(5, 10**9)),
+        ("2k", 2000),
+        ("1E", 10**18),
+        ("1Ei", 2**60),
+        ("1e3", 1000),
+        ("1E3", 1000),
+        ("1e-3", Fraction(1, 1000)),
+        ("1.5e+2", 150),
+        (".5", Fraction(1, 2)),
+        ("5.", 5),
+        ("+2M", 2 * 10**6),
+        ("-2M", -2 * 10**6),
+        ("0", 0),
+    ],
+)
+def test_quantities(quantity, expected):
+    assert _parse_quantity(quantity) == expected
+
+
+@pytest.mark.parametrize(
+    "quantity", ["", "Ki", "1KI", "1K", "1e", "1ee3", "1e1.5", "1..5", "--1", "1 Gi"]
+)
+def test_invalid_quantities(quantity):
+    with pytest.raises(ValueError):
+        _parse_quantity(quantity)
+
+
+def test_amounts():
+    assert _get_resource_amount_in_elements("2") == 2
+    assert _get_resource_amount_in_elements("500m") == 0.5
+    assert _get_resource_amount_in_elements(None) == 0
+    assert _get_resource_amount_in_bytes("1Gi") == 2**30
+    # Fractional bytes are rounded up
+    assert _get_resource_amount_in_bytes("1.0000001k") == 1001
+    assert _get_resource_amount_in_bytes("1m") == 1
+
+
+def test_parsed_quantities_are_memoized():
+    _parse_quantity.cache_clear()
+    assert _parse_quantity("4Gi") == 4 * 2**30
+    assert _parse_quantity("4Gi") == 4 * 2**30
+    info = _parse_quantity.cache_info()
+    assert (info.hits, info.misses) == (1, 1)
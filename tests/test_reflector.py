@@ -0,0 +1,229 @@
+import asyncio
+import json
+
+import aiohttp
+import pytest
+
+from dossier import utils
+from dossier.reflector import CustomObjectReflector
+
+
+def make_object(name, resource_version, groups=()):
+    return {
+        "metadata": {"name": name, "resourceVersion": resource_version},
+        "spec": {"groups": list(groups)},
+    }
+
+
+def event(type_, obj):
+    return (json.dumps({"type": type_, "object": obj}) + "\n").encode()
+
+
+class FakeContent:
+    def __init__(self, events):
+        self.events = events
+
+    async def readline(self):
+        return await self.events.get()
+
+
+class FakeResponse:
+    def __init__(self, events):
+        self.content = FakeContent(events)
+
+    def release(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeApi:
+    """Serves paginated lists of `objects`, and streams the lines put in `events`
+    to watches."""
+
+    def __init__(self, *objects, resource_version="1"):
+        self.objects = list(objects)
+        self.resource_version = resource_version
+        self.events = asyncio.Queue()
+        self.lists = 0
+        self.failing_lists = 0
+        self.watches = []
+
+    async def list_cluster_custom_object(
+        self, group, version, plural, watch=False, limit=None, _continue=None, **kwargs
+    ):
+        if watch:
+            self.watches.append(kwargs["resource_version"])
+            return FakeResponse(self.events)
+        start = int(_continue or 0)
+        if start == 0:
+            self.lists += 1
+            if self.failing_lists:
+                self.failing_lists -= 1
+                raise aiohttp.ClientConnectionError("Connection refused")
+        end = start + limit if limit else len(self.objects)
+        metadata = {"resourceVersion": self.resource_version}
+        if end < len(self.objects):
+            metadata["continue"] = str(end)
+        return {"items": self.objects[start:end], "metadata": metadata}
+
+
+async def wait_until(condition, timeout=2):
+    async def wait():
+        while not condition():
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(wait(), timeout)
+
+
+def make_reflector(api, **kwargs):
+    return CustomObjectReflector(
+        api=api,
+        group="capsule.clastix.io",
+        version="v1beta2",
+        plural="tenants",
+        indexers={"groups": lambda o: o["spec"]["groups"]},
+        **kwargs,
+    )
+
+
+def names(objects):
+    return sorted(o["metadata"]["name"] for o in objects)
+
+
+@pytest.mark.asyncio
+async def test_initial_list_is_paginated_and_indexed():
+    api = FakeApi(
+        make_object("a", "1", ["g1"]),
+        make_object("b", "1", ["g1", "g2"]),
+        make_object("c", "1", ["g2"]),
+    )
+    updated = []
+    reflector = make_reflector(api, page_size=2, on_update=updated.append)
+    await reflector.start()
+    try:
+        assert reflector.synced
+        assert api.lists == 1
+        assert sorted(reflector.resources) == ["a", "b", "c"]
+        assert names(reflector.by_index("groups", "g1")) == ["a", "b"]
+        assert names(reflector.by_index("groups", "g2")) == ["b", "c"]
+        assert names(updated) == ["a", "b", "c"]
+        assert reflector.collection_version == "1"
+    finally:
+        await reflector.stop()
+
+
+@pytest.mark.asyncio
+async def test_watch_events_update_store_and_indices():
+    api = FakeApi(make_object("a", "1", ["g1"]))
+    deleted = []
+    reflector = make_reflector(api, on_delete=deleted.append)
+    await reflector.start()
+    try:
+        await wait_until(lambda: api.watches)
+        assert api.watches == ["1"]
+
+        api.events.put_nowait(event("ADDED", make_object("b", "2", ["g1"])))
+        await wait_until(lambda: "b" in reflector.resources)
+        assert names(reflector.by_index("groups", "g1")) == ["a", "b"]
+        assert reflector.collection_version == "2"
+
+        api.events.put_nowait(event("MODIFIED", make_object("a", "3", ["g2"])))
+        await wait_until(lambda: reflector.resource_version == "3")
+        assert names(reflector.by_index("groups", "g1")) == ["b"]
+        assert names(reflector.by_index("groups", "g2")) == ["a"]
+
+        api.events.put_nowait(event("DELETED", make_object("b", "4", ["g1"])))
+        await wait_until(lambda: "b" not in reflector.resources)
+        assert reflector.by_index("groups", "g1") == []
+        assert "g1" not in reflector.indices["groups"]
+        assert names(deleted) == ["b"]
+
+        # Bookmarks move the resource version, but do not change the collection
+        api.events.put_nowait(event("BOOKMARK", {"metadata": {"resourceVersion": "5"}}))
+        await wait_until(lambda: reflector.resource_version == "5")
+        assert reflector.collection_version == "4"
+        assert api.lists == 1
+    finally:
+        await reflector.stop()
+
+
+@pytest.mark.asyncio
+async def test_expired_resource_version_triggers_a_relist():
+    api = FakeApi(make_object("a", "1", ["g1"]), make_object("b", "1", ["g1"]))
+    reflector = make_reflector(api)
+    await reflector.start()
+    try:
+        await wait_until(lambda: api.watches)
+        api.objects = [make_object("a", "7", ["g2"]), make_object("c", "7", ["g1"])]
+        api.resource_version = "7"
+        api.events.put_nowait(
+            event("ERROR", {"code": 410, "reason": "Gone", "message": "too old"})
+        )
+        await wait_until(lambda: api.lists == 2 and len(api.watches) == 2)
+        assert api.watches == ["1", "7"]
+        assert sorted(reflector.resources) == ["a", "c"]
+        assert names(reflector.by_index("groups", "g1")) == ["c"]
+        assert names(reflector.by_index("groups", "g2")) == ["a"]
+        assert reflector.synced
+    finally:
+        await reflector.stop()
+
+
+@pytest.mark.asyncio
+async def test_failed_watch_is_retried_until_a_relist_succeeds():
+    api = FakeApi(make_object("a", "1", ["g1"]))
+    reflector = make_reflector(api, max_retry_delay=0.2)
+    synced = []
+    reflector.observe(lambda change: synced.append(change["new"]), "synced")
+    await reflector.start()
+    try:
+        await wait_until(lambda: api.watches)
+        api.objects = [make_object("b", "2", ["g1"])]
+        api.resource_version = "2"
+        api.failing_lists = 3
+        api.events.put_nowait(
+            event("ERROR", {"code": 500, "reason": "Error", "message": "failed"})
+        )
+        await wait_until(lambda: api.lists == 5 and len(api.watches) == 2)
+        # The store was stale while the relists failed, and is synced again
+        assert synced == [True, False, True]
+        assert sorted(reflector.resources) == ["b"]
+        assert api.watches == ["1", "2"]
+    finally:
+        await reflector.stop()
+
+
+@pytest.mark.asyncio
+async def test_initial_list_is_retried_in_the_background():
+    api = FakeApi(make_object("a", "1", ["g1"]))
+    api.failing_lists = 2
+    reflector = make_reflector(api)
+    with pytest.raises(aiohttp.ClientConnectionError):
+        await reflector.start()
+    await reflector.start(wait=False)
+    try:
+        assert not reflector.synced
+        await wait_until(lambda: reflector.synced)
+        assert api.lists == 3
+        assert sorted(reflector.resources) == ["a"]
+    finally:
+        await reflector.stop()
+
+
+@pytest.mark.asyncio
+async def test_unreachable_api_server_falls_back_to_direct_calls():
+    api = FakeApi(make_object("a", "1", ["g1"]))
+    # Both collections fail their initial list, then the first retry
+    api.failing_lists = 4
+    await utils.start_reflectors(api)
+    try:
+        assert utils.get_collection_version("tenants") is None
+        assert utils.get_collection_version("spawners") is None
+        await wait_until(
+            lambda: utils.get_collection_version("tenants") is not None
+            and utils.get_collection_version("spawners") is not None
+        )
+    finally:
+        await utils.stop_reflectors()
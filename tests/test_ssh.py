@@ -0,0 +1,358 @@
+import asyncio
+import os
+import socket
+import subprocess
+from types import SimpleNamespace
+
+import asyncssh
+import pytest
+import pytest_asyncio
+
+from dossier.spawners.ssh import (
+    SSHConnectionPool,
+    SSHCredentialCache,
+    SSHHostPoller,
+    SSHHostProber,
+    SSHHostStopper,
+    SSHPortAllocator,
+    _launch_script_template,
+    _service_url_export,
+)
+
+
+class FakeConnection:
+    """An SSH connection whose `run` results are taken from `results`."""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.closed = asyncio.Event()
+        self.close_calls = 0
+        self.commands = []
+
+    async def run(self, command, **kwargs):
+        self.commands.append(command)
+        result = self.results.pop(0) if self.results else "ok"
+        if isinstance(result, Exception):
+            raise result
+        if isinstance(result, asyncio.Event):
+            await result.wait()
+            result = "ok"
+        return SimpleNamespace(stdout=result)
+
+    def close(self):
+        self.close_calls += 1
+        self.closed.set()
+
+    async def wait_closed(self):
+        await self.closed.wait()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+
+class LocalRunner:
+    """Runs remote commands with the local shell, counting the calls."""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self, command, input=None, **kwargs):
+        self.calls += 1
+        process = await asyncio.create_subprocess_exec(
+            "bash",
+            "-c",
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        stdout, stderr = await process.communicate(input and input.encode())
+        return SimpleNamespace(
+            stdout=stdout.decode(),
+            stderr=stderr.decode(),
+            exit_status=process.returncode,
+        )
+
+
+@pytest_asyncio.fixture
+async def processes():
+    """Start local processes, which are killed at the end of the test."""
+    started = []
+
+    async def start(*args):
+        process = subprocess.Popen(args or ["sleep", "60"])
+        started.append(process)
+        return process
+
+    yield start
+    for process in started:
+        process.kill()
+        process.wait()
+
+
+def fake_pool(*connections, **kwargs):
+    pool = SSHConnectionPool(**kwargs)
+    connections = list(connections)
+
+    async def connect(host, username, client_keys):
+        return connections.pop(0)
+
+    pool._connect = connect
+    return pool
+
+
+@pytest.mark.asyncio
+async def test_pool_reuses_connections():
+    conn = FakeConnection()
+    pool = fake_pool(conn)
+    for _ in range(3):
+        await pool.run("host", "user", [], "key", "true")
+    assert conn.commands == ["true"] * 3
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_lost_connection_is_closed_after_its_last_borrower():
+    release = asyncio.Event()
+    lost = FakeConnection(release, asyncssh.ConnectionLost("lost"))
+    fresh = FakeConnection()
+    pool = fake_pool(lost, fresh)
+    pending = asyncio.ensure_future(pool.run("host", "user", [], "key", "sleep"))
+    await asyncio.sleep(0)
+    # The command fails on the lost connection and is retried on a fresh one
+    assert (await pool.run("host", "user", [], "key", "true")).stdout == "ok"
+    assert fresh.commands == ["true"]
+    # The lost connection is not closed under the other borrower
+    assert lost.close_calls == 0
+    release.set()
+    await pending
+    assert lost.close_calls == 1
+    assert fresh.close_calls == 0
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_refused_channel_runs_on_a_temporary_connection():
+    pooled = FakeConnection(asyncssh.ChannelOpenError(1, "too many sessions"))
+    temporary = FakeConnection()
+    pool = fake_pool(pooled, temporary)
+    await pool.run("host", "user", [], "key", "true")
+    assert temporary.commands == ["true"]
+    assert temporary.close_calls == 1
+    # The pooled connection is still healthy, and stays in the pool
+    assert pooled.close_calls == 0
+    await pool.run("host", "user", [], "key", "true")
+    assert pooled.commands == ["true", "true"]
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_poller_shares_checks(processes):
+    alive, dead = await processes(), await processes("true")
+    dead.wait()
+    runner = LocalRunner()
+    poller = SSHHostPoller(host="host", username="user", max_age=60)
+    poller.register(alive.pid, runner)
+    poller.register(dead.pid, runner)
+    assert await asyncio.gather(
+        poller.is_alive(alive.pid), poller.is_alive(dead.pid)
+    ) == [True, False]
+    assert runner.calls == 1
+    # Results are reused within max_age
+    assert await poller.is_alive(alive.pid)
+    assert runner.calls == 1
+    # Processes registered after the last check trigger a new one
+    other = await processes()
+    poller.register(other.pid, runner)
+    assert await poller.is_alive(other.pid)
+    assert runner.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_poller_reports_failed_checks():
+    async def runner(command, **kwargs):
+        raise asyncssh.ConnectionLost("lost")
+
+    poller = SSHHostPoller(host="host", username="user")
+    poller.register(1234, runner)
+    assert await poller.is_alive(1234) is None
+    poller.unregister(1234)
+    assert await poller.is_alive(1234) is None
+
+
+@pytest.mark.asyncio
+async def test_prober_runs_as_its_own_account():
+    logins = []
+
+    async def runner(command, host, username, keyfile):
+        logins.append((host, username, keyfile))
+        load = {"a": "3.0", "b": "0.5", "c": "0.1"}[host]
+        if host == "c":
+            raise asyncssh.ConnectionLost("lost")
+        return SimpleNamespace(stdout=f"4 {load} 1000")
+
+    prober = SSHHostProber(username="probe", keyfile="~/probe", runner=runner)
+    try:
+        # The first placement waits for the first probes, and skips failed hosts
+        assert await prober.select(["a", "b", "c"], lambda h: 0) == "b"
+        assert sorted(logins) == [
+            ("a", "probe", "~/probe"),
+            ("b", "probe", "~/probe"),
+            ("c", "probe", "~/probe"),
+        ]
+        assert not prober.stats["c"]["healthy"]
+    finally:
+        await prober.stop()
+
+
+@pytest.mark.asyncio
+async def test_prober_without_account_places_by_notebooks():
+    async def runner(command, **kwargs):
+        raise AssertionError("No probe should run")
+
+    prober = SSHHostProber(runner=runner)
+    notebooks = {"a": 2, "b": 1}
+    assert await prober.select(["a", "b"], notebooks.get) == "b"
+    assert prober._task is None
+
+
+@pytest.mark.asyncio
+async def test_stopper_escalates_to_sigkill(processes):
+    terminated = await processes()
+    stubborn = await processes("bash", "-c", "trap '' TERM; sleep 60 & wait")
+    # Let the shell install its trap before signalling it
+    await asyncio.sleep(0.2)
+    runner = LocalRunner()
+    stopper = SSHHostStopper(host="host", username="user", kill_timeout=0.5)
+    assert await asyncio.gather(
+        stopper.stop(terminated.pid, runner), stopper.stop(stubborn.pid, runner)
+    ) == ["terminated", "killed"]
+    assert runner.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_stopper_reports_processes_that_survive(processes):
+    process = await processes()
+    local_runner = LocalRunner()
+
+    async def runner(command, input=None, **kwargs):
+        # Behave like a remote account that does not own the process
+        denied = "kill() { echo 'kill: Operation not permitted' >&2; return 1; }\n"
+        return await local_runner(command, input=denied + input, **kwargs)
+
+    stopper = SSHHostStopper(host="host", username="user", kill_timeout=0.2)
+    with pytest.raises(RuntimeError, match="still running"):
+        await stopper.stop(process.pid, runner)
+    assert process.poll() is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("pid", [0, -1])
+async def test_stopper_rejects_invalid_pids(pid):
+    runner = LocalRunner()
+    stopper = SSHHostStopper(host="host", username="user")
+    with pytest.raises(ValueError):
+        await stopper.stop(pid, runner)
+    assert runner.calls == 0
+
+
+def test_allocator_leases_distinct_ports():
+    allocator = SSHPortAllocator(min_port=50000, max_port=50002)
+    ports = {allocator.lease("a") for _ in range(3)}
+    assert ports == {50000, 50001, 50002}
+    assert allocator.count("a") == 3
+    with pytest.raises(RuntimeError):
+        allocator.lease("a")
+    # Hosts have separate tables
+    assert allocator.lease("b") in ports
+
+
+def test_allocator_restores_and_releases_leases():
+    allocator = SSHPortAllocator(min_port=50000, max_port=50001)
+    allocator.restore("a", 50000)
+    assert allocator.lease("a") == 50001
+    allocator.release("a", 50000)
+    assert allocator.count("a") == 1
+    assert allocator.lease("a") == 50000
+    allocator.release("a", 50000)
+    allocator.release("a", 50001)
+    assert allocator.count("a") == 0
+    assert "a" not in allocator._leases
+
+
+async def run_launch_script(port, busy_port_command):
+    prologue, epilogue = _launch_script_template(
+        f"echo {busy_port_command}", "echo $JUPYTERHUB_SERVICE_URL > url; sleep 60"
+    )
+    script = (
+        f"cd {os.getcwd()}\n"
+        f"port={port}\n"
+        + prologue
+        + _service_url_export(f"http://127.0.0.1:{port}/user/a/")
+        + epilogue
+    )
+    return (await LocalRunner()("bash -s", input=script)).stdout.split()
+
+
+@pytest.mark.asyncio
+async def test_launch_script_falls_back_when_the_leased_port_is_bound(
+    tmp_path, monkeypatch
+):
+    monkeypatch.chdir(tmp_path)
+    with socket.socket() as busy:
+        busy.bind(("127.0.0.1", 0))
+        busy.listen()
+        leased = busy.getsockname()[1]
+        port, pid = await run_launch_script(leased, 54321)
+    os.kill(int(pid), 9)
+    assert int(port) == 54321
+    for _ in range(100):
+        if (tmp_path / "url").exists():
+            break
+        await asyncio.sleep(0.01)
+    assert (tmp_path / "url").read_text().strip() == "http://127.0.0.1:54321/user/a/"
+
+
+@pytest.mark.asyncio
+async def test_launch_script_keeps_a_free_leased_port(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with socket.socket() as free:
+        free.bind(("127.0.0.1", 0))
+        leased = free.getsockname()[1]
+    port, pid = await run_launch_script(leased, 54321)
+    os.kill(int(pid), 9)
+    assert int(port) == leased
+
+
+@pytest.fixture
+def keyfile(tmp_path):
+    ca = asyncssh.generate_private_key("ssh-ed25519")
+    key = asyncssh.generate_private_key("ssh-ed25519")
+    path = str(tmp_path / "id_ed25519")
+    key.write_private_key(path)
+    ca.generate_user_certificate(key, "user").write_certificate(path + "-cert.pub")
+    return path
+
+
+@pytest.mark.asyncio
+async def test_credentials_are_cached_until_their_files_change(keyfile, monkeypatch):
+    loads = []
+    load = SSHCredentialCache._load
+
+    def counting_load(kf, cf):
+        loads.append(kf)
+        return load(kf, cf)
+
+    monkeypatch.setattr(SSHCredentialCache, "_load", staticmethod(counting_load))
+    cache = SSHCredentialCache()
+    first = await cache.get(keyfile)
+    assert await cache.get(keyfile) is first
+    assert loads == [keyfile]
+    # A rotated certificate has a different modification time
+    stat = os.stat(keyfile + "-cert.pub")
+    os.utime(keyfile + "-cert.pub", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert await cache.get(keyfile) is not first
+    assert loads == [keyfile, keyfile]
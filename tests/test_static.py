@@ -0,0 +1,86 @@
+import gzip
+import json
+
+import pytest
+import pytest_asyncio
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.httputil import HTTPServerRequest
+from tornado.testing import bind_unused_port
+
+from dossier.app import Dossier
+from dossier.handlers.static import DossierStaticFileHandler
+
+CSS = b"body { color: black; }\n" * 100
+FINGERPRINTED = "css/style.min.0123456789.css"
+
+
+@pytest.fixture
+def hub(tmp_path):
+    static = tmp_path / "static" / "dossier"
+    (static / "css").mkdir(parents=True)
+    (static / "css" / "style.min.css").write_bytes(CSS)
+    (static / FINGERPRINTED).write_bytes(CSS)
+    (static / (FINGERPRINTED + ".gz")).write_bytes(gzip.compress(CSS))
+    (static / "manifest.json").write_text(
+        json.dumps({"css/style.min.css": FINGERPRINTED})
+    )
+    DossierStaticFileHandler._manifests.clear()
+    app = Dossier(db_url="sqlite:///:memory:", data_files_path=str(tmp_path))
+    app.init_eventlog()
+    app.init_db()
+    app.init_hub()
+    app.init_proxy()
+    app.init_oauth()
+    app.init_services()
+    app.init_tornado_settings()
+    app.init_handlers()
+    app.init_tornado_application()
+    yield app
+    DossierStaticFileHandler._manifests.clear()
+
+
+@pytest_asyncio.fixture
+async def hub_url(hub):
+    sock, port = bind_unused_port()
+    server = HTTPServer(hub.tornado_application)
+    server.add_sockets([sock])
+    yield f"http://127.0.0.1:{port}"
+    server.stop()
+
+
+def test_assets_are_routed_to_the_dossier_handler(hub):
+    url = hub.tornado_settings["jinja2_env"].globals["dossier_static_url"](
+        "css/style.min.css"
+    )
+    assert url == "/hub/dossier-static/" + FINGERPRINTED
+    match = hub.tornado_application.find_handler(
+        HTTPServerRequest(method="GET", uri=url)
+    )
+    assert match.handler_class is DossierStaticFileHandler
+
+
+@pytest.mark.asyncio
+async def test_fingerprinted_assets_are_precompressed_and_immutable(hub, hub_url):
+    response = await AsyncHTTPClient().fetch(
+        f"{hub_url}/hub/dossier-static/{FINGERPRINTED}",
+        headers={"Accept-Encoding": "gzip"},
+        decompress_response=False,
+    )
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Content-Type"].startswith("text/css")
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert "immutable" in response.headers["Cache-Control"]
+    assert gzip.decompress(response.body) == CSS
+
+
+@pytest.mark.asyncio
+async def test_other_assets_are_revalidated(hub, hub_url):
+    response = await AsyncHTTPClient().fetch(
+        f"{hub_url}/hub/dossier-static/css/style.min.css",
+        headers={"Accept-Encoding": "identity"},
+        decompress_response=False,
+    )
+    assert "Content-Encoding" not in response.headers
+    assert response.headers["Cache-Control"] == "no-cache"
+    assert response.body == CSS
@@ -0,0 +1,94 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from dossier import utils
+
+
+class FakeCustomObjectsApi:
+    def __init__(self, *names):
+        self.names = names
+        self.field_selectors = []
+        self.accepts = []
+        self.api_client = SimpleNamespace(default_headers={})
+
+    async def list_cluster_custom_object(
+        self, group, version, plural, field_selector=None, **kwargs
+    ):
+        self.field_selectors.append(field_selector)
+        self.accepts.append(self.api_client.default_headers.get("Accept"))
+        return {
+            "items": [
+                {"metadata": {"name": n}}
+                for n in self.names
+                if field_selector in (None, f"metadata.name={n}")
+            ],
+            "metadata": {},
+        }
+
+
+@pytest.fixture(autouse=True)
+def cache():
+    utils.init_cache()
+
+
+@pytest.mark.asyncio
+async def test_user_tenants_are_filtered_by_name():
+    api = FakeCustomObjectsApi("t1", "t2", "t3")
+    tenants = await utils.get_user_tenants(api, ["t1", "t3", "other"])
+    assert sorted(tenants) == ["t1", "t3"]
+    assert sorted(api.field_selectors) == [
+        "metadata.name=other",
+        "metadata.name=t1",
+        "metadata.name=t3",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_groups_that_are_not_object_names_are_never_sent():
+    api = FakeCustomObjectsApi("t1")
+    tenants = await utils.get_user_tenants(
+        api, ["cn=admins,ou=groups,dc=example", "Staff", "a\\b", "t1"]
+    )
+    assert sorted(tenants) == ["t1"]
+    assert api.field_selectors == ["metadata.name=t1"]
+
+
+@pytest.mark.asyncio
+async def test_metadata_lists_do_not_change_the_shared_client():
+    api = FakeCustomObjectsApi("t1")
+    await utils._list_objects(api, "g", "v1", "tenants", metadata_only=True)
+    await utils._list_objects(api, "g", "v1", "tenants")
+    assert api.accepts == [utils._PARTIAL_OBJECT_METADATA_LIST, None]
+    assert api.api_client.default_headers == {}
+
+
+@pytest.mark.asyncio
+async def test_prefetched_lookups_are_reused_within_a_request():
+    api = FakeCustomObjectsApi("t1")
+    utils.start_request_scope()
+    utils.prefetch(utils.get_user_tenants(api, ["t1"]))
+    await asyncio.sleep(0.01)
+    assert api.field_selectors == ["metadata.name=t1"]
+    assert list(await utils.get_user_tenants(api, ["t1"])) == ["t1"]
+    assert api.field_selectors == ["metadata.name=t1"]
+
+
+@pytest.mark.asyncio
+async def test_prefetch_errors_are_raised_to_later_lookups():
+    api = FakeCustomObjectsApi("t1")
+    api.list_cluster_custom_object = None
+    utils.start_request_scope()
+    utils.prefetch(utils.get_user_tenants(api, ["t1"]))
+    await asyncio.sleep(0)
+    with pytest.raises(TypeError):
+        await utils.get_user_tenants(api, ["t1"])
+
+
+@pytest.mark.asyncio
+async def test_prefetch_outside_a_request_does_nothing():
+    api = FakeCustomObjectsApi("t1")
+    utils.prefetch(utils.get_user_tenants(api, ["t1"]))
+    await asyncio.sleep(0.01)
+    assert api.field_selectors == []